@@ -0,0 +1,249 @@
+"""
+Benchmarks the environments: construction time, reset times, steps per second, per-step latency percentiles and
+peak memory, for several topologies, numbers of spectrum resources and loads.
+Two reset times are reported: the full reset (`reset(only_counters=False)`), which clears the network state as at the
+start of a simulation, and the default reset between episodes, which only clears the counters.
+
+Only the time spent in `env.step` is measured: the actions are chosen by a shortest available path first-fit
+heuristic outside the timed region. Each case runs in a new process, so that the peak memory and the caches of one case do not affect the others.
+Results are printed as a table and can be written as JSON (`--output`), stored as a baseline (`--save-baseline`) and
+compared against a stored baseline (`--baseline`), in which case the script exits with status 1 if the steps per
+second of any case dropped by more than `--tolerance`. Baselines are specific to a machine, so they are not kept in
+the repository.
+
+Usage (from the root of the repository):
+
+    python benchmarks/run.py --quick --save-baseline benchmarks/results/baseline.json
+    python benchmarks/run.py --quick --baseline benchmarks/results/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import platform
+import argparse
+import multiprocessing as mp
+import networkx as nx
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# the same modulation formats as `examples/create_topology_rmsa.py`
+MODULATIONS = [{'modulation': 'BPSK', 'capacity': 12.5, 'maximum_length': 100000},
+               {'modulation': 'QPSK', 'capacity': 25., 'maximum_length': 2000},
+               {'modulation': '8QAM', 'capacity': 37.5, 'maximum_length': 1250},
+               {'modulation': '16QAM', 'capacity': 50., 'maximum_length': 625}]
+
+MEAN_SERVICE_HOLDING_TIME = 25.
+
+
+def _synthetic_topology(num_nodes, seed=0):
+    """
+    Returns a connected mesh with node degree 3 and link lengths between 100 and 1500 km, standing in for a large
+    SNDlib topology when none is given.
+    """
+    rng = np.random.default_rng(seed)
+    graph = nx.random_regular_graph(3, num_nodes, seed=seed)
+    topology = nx.Graph()
+    topology.add_nodes_from(str(node) for node in sorted(graph.nodes()))
+    for idx, (n1, n2) in enumerate(sorted(graph.edges())):
+        topology.add_edge(str(n1), str(n2), index=idx, weight=1, length=float(rng.integers(100, 1500)))
+    return topology
+
+
+def get_topology(name):
+    """
+    Loads a topology by name: 'nsfnet' (shipped with the examples), 'synthetic-<nodes>', the path of a pickled
+    topology, or the path of an SNDlib XML file (e.g., from http://sndlib.zib.de).
+    """
+    from optical_rl_gym.topology import build_topology
+    cache_dir = os.path.join(RESULTS_DIR, 'cache')
+    # the cases run in daemonic pool workers, which cannot start the process pool that computes the paths
+    num_workers = 1
+    if name == 'nsfnet':
+        name = os.path.join(ROOT, 'examples', 'topologies', 'nsfnet_chen_eon_5-paths.h5')
+    if name.startswith('synthetic-'):
+        return build_topology(_synthetic_topology(int(name.split('-')[1])), name, k_paths=5, modulations=MODULATIONS,
+                              num_workers=num_workers, cache_dir=cache_dir)
+    if name.endswith('.xml'):
+        sys.path.insert(0, os.path.join(ROOT, 'examples'))
+        from graph_utils import read_sndlib_topology
+        return build_topology(read_sndlib_topology(name), os.path.basename(name)[:-4], k_paths=5,
+                              modulations=MODULATIONS, num_workers=num_workers, cache_dir=cache_dir)
+    with open(name, 'rb') as f:
+        return pickle.load(f)
+
+
+def _policy(env_id):
+    if env_id == 'RMSA-v0':
+        from optical_rl_gym.envs.rmsa_env import shortest_available_path_first_fit
+        return shortest_available_path_first_fit
+    if env_id == 'DeepRMSA-v0':
+        from optical_rl_gym.envs.deeprmsa_env import shortest_available_path_first_fit
+        return shortest_available_path_first_fit
+    if env_id == 'RWA-v0':
+        from optical_rl_gym.envs.rwa_env import shortest_available_path
+        return shortest_available_path
+    from optical_rl_gym.envs.qos_constrained_ra import shortest_available_path
+    return shortest_available_path
+
+
+def _env_kwargs(env_id, num_spectrum_resources, load, episode_length):
+    kwargs = dict(num_spectrum_resources=num_spectrum_resources, episode_length=episode_length,
+                  mean_service_holding_time=MEAN_SERVICE_HOLDING_TIME, seed=10)
+    if env_id == 'DeepRMSA-v0':
+        kwargs['mean_service_inter_arrival_time'] = MEAN_SERVICE_HOLDING_TIME / load
+    else:
+        kwargs['load'] = load
+    return kwargs
+
+
+def run_case(case, steps, warmup):
+    """
+    Runs one case in the calling process.
+
+    :return: dict with the measurements of the case
+    """
+    import gym
+    import optical_rl_gym  # registers the environments
+    topology = get_topology(case['topology'])
+    policy = _policy(case['env_id'])
+
+    start = time.perf_counter()
+    env = gym.make(case['env_id'], topology=topology,
+                   **_env_kwargs(case['env_id'], case['num_spectrum_resources'], case['load'], steps + warmup))
+    construction_time = time.perf_counter() - start
+    start = time.perf_counter()
+    env.reset(only_counters=False)
+    full_reset_time = time.perf_counter() - start
+    start = time.perf_counter()
+    env.reset()
+    counters_reset_time = time.perf_counter() - start
+
+    latencies = np.zeros(steps)
+    for step in range(warmup + steps):
+        action = policy(env)
+        start = time.perf_counter()
+        _, _, done, _ = env.step(action)
+        if step >= warmup:
+            latencies[step - warmup] = time.perf_counter() - start
+        if done:
+            env.reset()
+    result = dict(case)
+    result.update({
+        'construction_s': construction_time,
+        'full_reset_s': full_reset_time,
+        'counters_reset_s': counters_reset_time,
+        'steps_per_s': steps / np.sum(latencies),
+        'latency_us': {'p50': np.percentile(latencies, 50) * 1e6, 'p90': np.percentile(latencies, 90) * 1e6,
+                       'p99': np.percentile(latencies, 99) * 1e6},
+        'peak_rss_mb': _peak_rss_mb(),
+    })
+    return result
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10  # bytes on macOS, kilobytes on Linux
+
+
+def cases(quick=False, topologies=None, env_ids=None):
+    """
+    Returns the benchmark cases: every environment over each topology, with increasing numbers of spectrum resources
+    at a moderate load, and with increasing loads at 64 slots.
+    """
+    env_ids = env_ids or ['RMSA-v0', 'DeepRMSA-v0', 'RWA-v0', 'QoSConstrainedRA-v0']
+    topologies = topologies or (['nsfnet'] if quick else ['nsfnet', 'synthetic-40'])
+    slots = [64, 320] if quick else [64, 128, 320, 768]
+    loads = [100] if quick else [100, 300]
+    result = []
+    for topology in topologies:
+        for env_id in env_ids:
+            points = [(num_slots, 100) for num_slots in slots] + [(64, load) for load in loads if load != 100]
+            for num_slots, load in points:
+                result.append({'name': '{}/{}/{}slots/load{}'.format(env_id, topology, num_slots, load),
+                               'env_id': env_id, 'topology': topology, 'num_spectrum_resources': num_slots,
+                               'load': load})
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the steps per second of the results with those of a baseline.
+
+    :return: list of `(name, baseline steps/s, steps/s, ratio)` of the cases slower than the baseline by more than
+        `tolerance`
+    """
+    previous = {case['name']: case for case in baseline['cases']}
+    regressions = []
+    for case in results['cases']:
+        if case['name'] not in previous:
+            continue
+        ratio = case['steps_per_s'] / previous[case['name']]['steps_per_s']
+        print('{:<55} {:>10.1f} -> {:>10.1f} steps/s ({:+.1%})'.format(
+            case['name'], previous[case['name']]['steps_per_s'], case['steps_per_s'], ratio - 1))
+        if ratio < 1 - tolerance:
+            regressions.append((case['name'], previous[case['name']]['steps_per_s'], case['steps_per_s'], ratio))
+    return regressions
+
+
+def _write(results, file):
+    os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+    with open(file, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the Optical RL-Gym environments.')
+    parser.add_argument('--quick', action='store_true', help='run a reduced set of cases')
+    parser.add_argument('--steps', type=int, default=2000, help='timed steps per case')
+    parser.add_argument('--warmup', type=int, default=200, help='untimed steps before the timed ones')
+    parser.add_argument('--topology', action='append', help="'nsfnet', 'synthetic-<nodes>', or the path of a "
+                                                            "pickled topology or of an SNDlib XML file")
+    parser.add_argument('--env', action='append', help='environment id, e.g., RMSA-v0')
+    parser.add_argument('--filter', default=None, help='only run the cases whose name contains this string')
+    parser.add_argument('--output', default=None, help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=None, help='compare against the results in this JSON file')
+    parser.add_argument('--save-baseline', default=None, help='also write the results to this JSON file')
+    parser.add_argument('--tolerance', type=float, default=.1, help='allowed relative drop of steps per second')
+    args = parser.parse_args()
+
+    selected = [case for case in cases(args.quick, args.topology, args.env)
+                if args.filter is None or args.filter in case['name']]
+    results = {'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                           'platform': platform.platform(), 'processor': platform.processor(),
+                           'cpu_count': os.cpu_count()},
+               'steps': args.steps, 'warmup': args.warmup, 'cases': []}
+    print('{:<55} {:>10} {:>9} {:>9} {:>9} {:>10} {:>13} {:>12} {:>9}'.format(
+        'case', 'steps/s', 'p50 us', 'p90 us', 'p99 us', 'build s', 'full reset ms', 'ctr reset ms', 'peak MB'))
+    context = mp.get_context('spawn')
+    for case in selected:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_case, (case, args.steps, args.warmup))
+        results['cases'].append(result)
+        print('{:<55} {:>10.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>10.3f} {:>13.3f} {:>12.3f} {:>9.1f}'.format(
+            result['name'], result['steps_per_s'], result['latency_us']['p50'], result['latency_us']['p90'],
+            result['latency_us']['p99'], result['construction_s'], result['full_reset_s'] * 1e3,
+            result['counters_reset_s'] * 1e3, result['peak_rss_mb'] or 0))
+
+    if args.output is not None:
+        _write(results, args.output)
+    if args.save_baseline is not None:
+        _write(results, args.save_baseline)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, previous, current, ratio in regressions:
+            print('REGRESSION {}: {:.1f} -> {:.1f} steps/s ({:+.1%})'.format(name, previous, current, ratio - 1))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
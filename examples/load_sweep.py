@@ -0,0 +1,33 @@
+import pickle
+import argparse
+
+from optical_rl_gym.evaluation import load_sweep
+from optical_rl_gym.envs.rmsa_env import shortest_path_first_fit, shortest_available_path_first_fit, \
+    least_loaded_path_first_fit
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Blocking probability vs load of the RMSA heuristics.')
+    parser.add_argument('--topology', default='./topologies/nsfnet_chen_eon_5-paths.h5')
+    parser.add_argument('--loads', type=float, nargs='+', default=[100, 150, 200, 250, 300])
+    parser.add_argument('--episodes', type=int, default=10)
+    parser.add_argument('--episode-length', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.topology, 'rb') as f:
+        topology = pickle.load(f)
+
+    heuristics = [shortest_path_first_fit, shortest_available_path_first_fit, least_loaded_path_first_fit]
+    sweep = load_sweep('RMSA-v0', heuristics, topology, args.loads,
+                       env_kwargs=dict(episode_length=args.episode_length, mean_service_holding_time=25,
+                                       num_spectrum_resources=64),
+                       n_eval_episodes=args.episodes, seed=args.seed, num_workers=args.workers)
+
+    for metric in ('episode_service_blocking_rate', 'episode_bit_rate_blocking_rate'):
+        print(metric)
+        print('load'.rjust(8) + ''.join(name.rjust(40) for name in sweep['heuristics']))
+        for idl, load in enumerate(sweep['loads']):
+            print(f'{load:8.1f}' + ''.join(f"{sweep['mean'][metric][idh, idl]:.4f} +- "
+                                           f"{sweep['half_width'][metric][idh, idl]:.4f}".rjust(40)
+                                           for idh in range(len(heuristics))))
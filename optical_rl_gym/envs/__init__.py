@@ -2,3 +2,4 @@ from optical_rl_gym.envs.rmsa_env import RMSAEnv
 from optical_rl_gym.envs.deeprmsa_env import DeepRMSAEnv
 from optical_rl_gym.envs.rwa_env import RWAEnv
 from optical_rl_gym.envs.qos_constrained_ra import QoSConstrainedRA
+from optical_rl_gym.envs.batched_rmsa_env import BatchedRMSAEnv
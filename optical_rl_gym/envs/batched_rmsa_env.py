@@ -0,0 +1,307 @@
+import gym
+import random
+import numpy as np
+
+from optical_rl_gym.utils import EventQueue, NodePairSampler, get_path_index, indexed_topology
+from optical_rl_gym.spectrum import contiguous_fits
+from .rmsa_env import RMSAEnv
+
+
+class BatchedRMSAEnv(gym.Env):
+    """
+    Runs `num_envs` independent RMSA simulations over the same topology.
+    The spectrum of all simulations is held in a single `(num_envs, E, S)` array, and every call to `step` provisions,
+    releases and builds the observations of all simulations with array operations.
+
+    Each simulation `i` draws its traffic exactly as an `RMSAEnv` seeded with `seed + i`, so results are comparable
+    with the single environment. Link and network statistics (fragmentation, compactness, etc.) are not computed.
+    Only RMSA is batched: there is no batched version of `DeepRMSAEnv`, whose observation is built from the
+    per-path spectrum summaries of `RMSAEnv.get_path_spectrum_summary`.
+    """
+
+    metadata = RMSAEnv.metadata
+
+    def __init__(self, topology=None,
+                 num_envs=8,
+                 episode_length=1000,
+                 load=10,
+                 mean_service_holding_time=10800.0,
+                 num_spectrum_resources=100,
+                 node_request_probabilities=None,
+                 bit_rate_lower_bound=25,
+                 bit_rate_higher_bound=100,
+                 seed=None,
+                 allow_rejection=False,
+                 reset=True):
+        assert topology is not None and 'ksp' in topology.graph
+        assert 'modulations' in topology.graph
+        assert node_request_probabilities is None or len(node_request_probabilities) == topology.number_of_nodes()
+        # the paths are indexed on a copy if needed, so the topology of the caller is not modified
+        self.topology = indexed_topology(topology)
+        self.topology_name = topology.graph['name']
+        self.k_paths = topology.graph['k_paths']
+        self.k_shortest_paths = self.topology.graph['ksp']
+        self.num_envs = num_envs
+        self.episode_length = episode_length
+        self.num_spectrum_resources = num_spectrum_resources
+        self.bit_rate_lower_bound = bit_rate_lower_bound
+        self.bit_rate_higher_bound = bit_rate_higher_bound
+        self.allow_rejection = allow_rejection
+        self.reject_action = 1 if allow_rejection else 0
+
+        self.load = 0
+        self.mean_service_holding_time = 0
+        self.mean_service_inter_arrival_time = 0
+        self.set_load(load=load, mean_service_holding_time=mean_service_holding_time)
+
+        self.nodes = list(self.topology.graph['node_indices'])
+        if node_request_probabilities is not None:
+            self.node_request_probabilities = node_request_probabilities
+        else:
+            self.node_request_probabilities = np.full((len(self.nodes)), fill_value=1. / len(self.nodes))
+
+        self._build_path_index()
+
+        self.rand_seed = None
+        self.rngs = None
+        self.seed(seed=seed)
+
+        num_nodes = len(self.nodes)
+        num_edges = self.topology.number_of_edges()
+        self.action_space = gym.spaces.MultiDiscrete((self.k_paths + self.reject_action,
+                                                      self.num_spectrum_resources + self.reject_action))
+        self.observation_space = gym.spaces.Box(low=0, high=1, dtype=np.uint8,
+                                                shape=(2 * num_nodes + num_edges * self.num_spectrum_resources,))
+        self.action_space.seed(self.rand_seed)
+        self.observation_space.seed(self.rand_seed)
+
+        self.available_slots = np.ones((self.num_envs, num_edges, self.num_spectrum_resources), dtype=np.uint8)
+        self._slot_indices = np.arange(self.num_spectrum_resources)
+        self._env_indices = np.arange(self.num_envs)
+        self._events = [EventQueue() for _ in range(self.num_envs)]
+        self.current_time = np.zeros(self.num_envs)
+
+        # request being processed in each simulation
+        self.source_id = np.zeros(self.num_envs, dtype=int)
+        self.destination_id = np.zeros(self.num_envs, dtype=int)
+        self.arrival_time = np.zeros(self.num_envs)
+        self.holding_time = np.zeros(self.num_envs)
+        self.bit_rate = np.zeros(self.num_envs, dtype=int)
+        self.number_slots = np.zeros((self.num_envs, self.k_paths), dtype=int)
+        self._action_masks = None
+
+        self.services_processed = np.zeros(self.num_envs, dtype=int)
+        self.services_accepted = np.zeros(self.num_envs, dtype=int)
+        self.episode_services_processed = np.zeros(self.num_envs, dtype=int)
+        self.episode_services_accepted = np.zeros(self.num_envs, dtype=int)
+        self.bit_rate_requested = np.zeros(self.num_envs, dtype=int)
+        self.bit_rate_provisioned = np.zeros(self.num_envs, dtype=int)
+        self.episode_bit_rate_requested = np.zeros(self.num_envs, dtype=int)
+        self.episode_bit_rate_provisioned = np.zeros(self.num_envs, dtype=int)
+        if reset:
+            self.reset(only_counters=False)
+
+    def _build_path_index(self):
+        """
+        Builds the integer index used by the array operations: a path x link incidence matrix, the capacity of the
+        modulation format of each path, and the rows of the k paths of each node pair (-1 if a pair has less paths).
+        """
+        node_ids = {node: idx for idx, node in enumerate(self.nodes)}
+        paths, self.path_link_incidence = get_path_index(self.topology)
+        path_rows = {id(path): row for row, path in enumerate(paths)}
+        self.path_capacity = np.array([path.best_modulation['capacity'] for path in paths])
+
+        self.pair_paths = np.full((len(self.nodes), len(self.nodes), self.k_paths), fill_value=-1, dtype=int)
+        for (src, dst), path_list in self.k_shortest_paths.items():
+            for idp, path in enumerate(path_list[:self.k_paths]):
+                self.pair_paths[node_ids[src], node_ids[dst], idp] = path_rows[id(path)]
+
+    @property
+    def node_request_probabilities(self):
+        return self._node_request_probabilities
+
+    @node_request_probabilities.setter
+    def node_request_probabilities(self, node_request_probabilities):
+        self._node_request_probabilities = node_request_probabilities
+        self._node_pair_sampler = NodePairSampler(self.nodes, range(len(self.nodes)), node_request_probabilities)
+
+    def set_load(self, load=None, mean_service_holding_time=None):
+        """
+        Sets the load to be used to generate requests in all simulations.
+        :param load: The load to be generated, in Erlangs
+        :param mean_service_holding_time: The mean service holding time to be used to generate the requests
+        :return: None
+        """
+        if load is not None:
+            self.load = load
+        if mean_service_holding_time is not None:
+            self.mean_service_holding_time = mean_service_holding_time
+        self.mean_service_inter_arrival_time = 1 / float(self.load / float(self.mean_service_holding_time))
+
+    def seed(self, seed=None):
+        if seed is not None:
+            self.rand_seed = seed
+        else:
+            self.rand_seed = 41
+        self.rngs = [random.Random(self.rand_seed + i) for i in range(self.num_envs)]
+
+    def step(self, actions):
+        actions = np.asarray(actions, dtype=int).reshape((self.num_envs, 2))
+        path, initial_slot = actions[:, 0], actions[:, 1]
+
+        rows = self.pair_paths[self.source_id, self.destination_id, np.minimum(path, self.k_paths - 1)]
+        slots = self.number_slots[self._env_indices, np.minimum(path, self.k_paths - 1)]
+        valid = (path < self.k_paths) & (rows >= 0) & (initial_slot + slots <= self.num_spectrum_resources)
+
+        # (N, E, S) mask of the slots requested by each simulation
+        request = self.path_link_incidence[rows][:, :, None] & \
+            ((self._slot_indices >= initial_slot[:, None]) &
+             (self._slot_indices < (initial_slot + slots)[:, None]))[:, None, :]
+        request &= valid[:, None, None]
+        accepted = valid & ~np.any(request & (self.available_slots == 0), axis=(1, 2))
+        self.available_slots[request & accepted[:, None, None]] = 0
+
+        for env in np.flatnonzero(accepted):
+            self._events[env].push(self.arrival_time[env] + self.holding_time[env],
+                                   (rows[env], initial_slot[env], slots[env]))
+
+        self.services_processed += 1
+        self.episode_services_processed += 1
+        self.services_accepted += accepted
+        self.episode_services_accepted += accepted
+        self.bit_rate_requested += self.bit_rate
+        self.episode_bit_rate_requested += self.bit_rate
+        self.bit_rate_provisioned += self.bit_rate * accepted
+        self.episode_bit_rate_provisioned += self.bit_rate * accepted
+
+        rewards = accepted.astype(float)
+        infos = [{
+                    'service_blocking_rate': (self.services_processed[env] - self.services_accepted[env]) / self.services_processed[env],
+                    'episode_service_blocking_rate': (self.episode_services_processed[env] - self.episode_services_accepted[env]) / self.episode_services_processed[env],
+                    'bit_rate_blocking_rate': (self.bit_rate_requested[env] - self.bit_rate_provisioned[env]) / self.bit_rate_requested[env],
+                    'episode_bit_rate_blocking_rate': (self.episode_bit_rate_requested[env] - self.episode_bit_rate_provisioned[env]) / self.episode_bit_rate_requested[env]
+                } for env in range(self.num_envs)]
+        dones = self.episode_services_processed == self.episode_length
+        # simulations that finished their episode continue from the current network state, as `reset(only_counters=True)`
+        self._reset_episode_counters(dones)
+
+        self._next_services()
+        return self.observation(), rewards, dones, infos
+
+    def reset(self, only_counters=True):
+        self._reset_episode_counters(np.ones(self.num_envs, dtype=bool))
+        if only_counters:
+            return self.observation()
+
+        self.available_slots[:] = 1
+        for events in self._events:
+            events.clear()
+        self.current_time[:] = 0
+        self.services_processed[:] = 0
+        self.services_accepted[:] = 0
+        self.bit_rate_requested[:] = 0
+        self.bit_rate_provisioned[:] = 0
+
+        self._next_services()
+        return self.observation()
+
+    def _reset_episode_counters(self, envs):
+        self.episode_services_processed[envs] = 0
+        self.episode_services_accepted[envs] = 0
+        self.episode_bit_rate_requested[envs] = 0
+        self.episode_bit_rate_provisioned[envs] = 0
+
+    def render(self, mode='human'):
+        return
+
+    def observation(self):
+        num_nodes = len(self.nodes)
+        observation = np.zeros((self.num_envs,) + self.observation_space.shape, dtype=np.uint8)
+        observation[self._env_indices, np.minimum(self.source_id, self.destination_id)] = 1
+        observation[self._env_indices, num_nodes + np.maximum(self.source_id, self.destination_id)] = 1
+        observation[:, 2 * num_nodes:] = self.available_slots.reshape((self.num_envs, -1))
+        return observation
+
+    def action_masks(self) -> np.ndarray:
+        """
+        Returns the stacked per-dimension masks of the valid actions of every simulation, with shape
+        `(num_envs, sum(action_space.nvec))`, as `RMSAEnv.action_masks`.
+        """
+        joint = self.joint_action_masks()
+        return np.concatenate((np.any(joint, axis=2), np.any(joint, axis=1)), axis=1)
+
+    def joint_action_masks(self) -> np.ndarray:
+        """
+        Returns the stacked `(num_envs, k_paths + r, num_spectrum_resources + r)` masks of the valid actions of
+        every simulation, as `RMSAEnv.joint_action_masks`.
+        """
+        if self._action_masks is None:
+            rows = self.pair_paths[self.source_id, self.destination_id]
+            incidence = self.path_link_incidence[np.maximum(rows, 0)]
+            path_slots = np.all((self.available_slots[:, None, :, :] == 1) | ~incidence[:, :, :, None], axis=2)
+            mask = np.zeros((self.num_envs,) + tuple(self.action_space.nvec), dtype=bool)
+            mask[:, :self.k_paths, :self.num_spectrum_resources] = contiguous_fits(path_slots, self.number_slots) & \
+                (rows >= 0)[:, :, None]
+            if self.reject_action == 1:
+                mask[:, self.k_paths, self.num_spectrum_resources] = True
+            else:
+                mask[~np.any(mask, axis=(1, 2))] = True
+            self._action_masks = mask
+        return self._action_masks
+
+    def _get_node_pair(self, rng):
+        _, src_id, _, dst_id = self._node_pair_sampler.sample(rng)
+        return src_id, dst_id
+
+    def _next_services(self):
+        """
+        Draws the next request of every simulation and releases, in a single array operation, all the services
+        that expired in any of the simulations up to the arrival of its next request.
+        """
+        release_envs, release_rows, release_first, release_last = [], [], [], []
+        for env, rng in enumerate(self.rngs):
+            at = self.current_time[env] + rng.expovariate(1 / self.mean_service_inter_arrival_time)
+            self.current_time[env] = at
+            self.arrival_time[env] = at
+            self.holding_time[env] = rng.expovariate(1 / self.mean_service_holding_time)
+            self.source_id[env], self.destination_id[env] = self._get_node_pair(rng)
+            self.bit_rate[env] = rng.randint(self.bit_rate_lower_bound, self.bit_rate_higher_bound)
+
+            for row, initial_slot, number_slots in self._events[env].pop_until(at):
+                release_envs.append(env)
+                release_rows.append(row)
+                release_first.append(initial_slot)
+                release_last.append(initial_slot + number_slots)
+
+        if len(release_envs) > 0:
+            release_first = np.array(release_first)
+            release_last = np.array(release_last)
+            released = self.path_link_incidence[release_rows][:, :, None] & \
+                ((self._slot_indices >= release_first[:, None]) &
+                 (self._slot_indices < release_last[:, None]))[:, None, :]
+            idx, link, slot = np.nonzero(released)
+            self.available_slots[np.array(release_envs)[idx], link, slot] = 1
+
+        # number of slots required by the new request on each of the k paths
+        rows = self.pair_paths[self.source_id, self.destination_id]
+        capacity = np.where(rows >= 0, self.path_capacity[rows], np.inf)
+        self.number_slots = (np.ceil(self.bit_rate[:, None] / capacity) + 1).astype(int)
+        self._action_masks = None
+
+
+def shortest_path_first_fit(env: BatchedRMSAEnv) -> np.ndarray:
+    """
+    Computes the shortest path first-fit action of every simulation at once.
+    """
+    rows = env.pair_paths[env.source_id, env.destination_id, 0]
+    num_slots = env.number_slots[:, 0]
+    path_slots = ~np.any(env.path_link_incidence[rows][:, :, None] & (env.available_slots == 0), axis=1)
+
+    fits = contiguous_fits(path_slots, num_slots)
+    # same search range as `rmsa_env.shortest_path_first_fit`
+    fits &= env._slot_indices[None, :] < (env.num_spectrum_resources - num_slots)[:, None]
+
+    actions = np.empty((env.num_envs, 2), dtype=int)
+    actions[:, 0] = np.where(fits.any(axis=1), 0, env.k_paths)
+    actions[:, 1] = np.where(fits.any(axis=1), np.argmax(fits, axis=1), env.num_spectrum_resources)
+    return actions
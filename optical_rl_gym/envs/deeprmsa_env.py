@@ -15,7 +15,11 @@ class DeepRMSAEnv(RMSAEnv):
                  node_request_probabilities=None,
                  seed=None,
                  k_paths=5,
-                 allow_rejection=False):
+                 allow_rejection=False,
+                 spectrum_backend='array',
+                 service_retention='all',
+                 traffic=None,
+                 traffic_chunk_size=None):
         super().__init__(topology=topology,
                          episode_length=episode_length,
                          load=mean_service_holding_time / mean_service_inter_arrival_time,
@@ -25,12 +29,21 @@ class DeepRMSAEnv(RMSAEnv):
                          seed=seed,
                          k_paths=k_paths,
                          allow_rejection=allow_rejection,
+                         spectrum_backend=spectrum_backend,
+                         service_retention=service_retention,
+                         traffic=traffic,
+                         traffic_chunk_size=traffic_chunk_size,
                          reset=False)
 
         self.j = j
         shape = 1 + 2 * self.topology.number_of_nodes() + (2 * self.j + 3) * self.k_paths
         self.observation_space = gym.spaces.Box(low=0, high=1, dtype=np.uint8, shape=(shape,))
         self.action_space = gym.spaces.Discrete(self.k_paths * self.j + self.reject_action)
+        self._observation = np.zeros(shape)
+        self._source_destination = self._observation[1:1 + 2 * self.topology.number_of_nodes()] \
+            .reshape((2, self.topology.number_of_nodes()))
+        self._spectrum_obs = self._observation[1 + 2 * self.topology.number_of_nodes():] \
+            .reshape((self.k_paths, 2 * self.j + 3))
         self.action_space.seed(self.rand_seed)
         self.observation_space.seed(self.rand_seed)
         self.reset(only_counters=False)
@@ -49,36 +62,52 @@ class DeepRMSAEnv(RMSAEnv):
 
     def observation(self):
         # observation space defined as in https://github.com/xiaoliangchenUCD/DeepRMSA/blob/eb2f2442acc25574e9efb4104ea245e9e05d9821/DeepRMSA_Agent.py#L384
-        source_destination_tau = np.zeros((2, self.topology.number_of_nodes()))
-        min_node = min(self.service.source_id, self.service.destination_id)
-        max_node = max(self.service.source_id, self.service.destination_id)
-        source_destination_tau[0, min_node] = 1
-        source_destination_tau[1, max_node] = 1
-        spectrum_obs = np.full((self.k_paths, 2 * self.j + 3), fill_value=-1.)
+        # assembled in place: bit rate, source/destination one-hot encodings, and (2 * j + 3) values per path
+        self._observation[:1 + self._source_destination.size] = 0
+        self._observation[0] = self.service.bit_rate / 100
+        self._source_destination[0, min(self.service.source_id, self.service.destination_id)] = 1
+        self._source_destination[1, max(self.service.source_id, self.service.destination_id)] = 1
+        spectrum_obs = self._spectrum_obs
+        spectrum_obs[:] = -1.
         for idp, path in enumerate(self.k_shortest_paths[self.service.source, self.service.destination]):
-            available_slots = self.get_available_slots(path)
+            _, initial_indices, lengths, total_slots, mean_length = self.get_path_spectrum_summary(path)
             num_slots = self.get_number_slots(path)
-            initial_indices, lengths = self.get_available_blocks(idp)
+            sufficient_indices = np.flatnonzero(lengths >= num_slots)[:self.j]
+            num_blocks = len(sufficient_indices)
 
-            for idb, (initial_index, length) in enumerate(zip(initial_indices, lengths)):
-                # initial slot index
-                spectrum_obs[idp, idb * 2 + 0] = 2 * (initial_index - .5 * self.num_spectrum_resources) / self.num_spectrum_resources
-
-                # number of contiguous FS available
-                spectrum_obs[idp, idb * 2 + 1] = (length - 8) / 8
+            # initial slot index
+            spectrum_obs[idp, 0:2 * num_blocks:2] = 2 * (initial_indices[sufficient_indices] - .5 * self.num_spectrum_resources) / self.num_spectrum_resources
+            # number of contiguous FS available
+            spectrum_obs[idp, 1:2 * num_blocks:2] = (lengths[sufficient_indices] - 8) / 8
             spectrum_obs[idp, self.j * 2] = (num_slots - 5.5) / 3.5 # number of FSs necessary
 
-            idx, values, lengths = DeepRMSAEnv.rle(available_slots)
-
-            av_indices = np.argwhere(values == 1) # getting indices which have value 1
-            spectrum_obs[idp, self.j * 2 + 1] = 2 * (np.sum(available_slots) - .5 * self.num_spectrum_resources) / self.num_spectrum_resources # total number available FSs
-            spectrum_obs[idp, self.j * 2 + 2] = (np.mean(lengths[av_indices]) - 4) / 4 # avg. number of FS blocks available
-        bit_rate_obs = np.zeros((1, 1))
-        bit_rate_obs[0, 0] = self.service.bit_rate / 100
-
-        return np.concatenate((bit_rate_obs, source_destination_tau.reshape((1, np.prod(source_destination_tau.shape))),
-                               spectrum_obs.reshape((1, np.prod(spectrum_obs.shape)))), axis=1)\
-            .reshape(self.observation_space.shape)
+            spectrum_obs[idp, self.j * 2 + 1] = 2 * (total_slots - .5 * self.num_spectrum_resources) / self.num_spectrum_resources # total number available FSs
+            spectrum_obs[idp, self.j * 2 + 2] = (mean_length - 4) / 4 # avg. number of FS blocks available
+        return self._observation.copy()
+
+    def action_masks(self) -> np.ndarray:
+        """
+        Returns the boolean mask of the valid actions for the current service: action `p * j + b` is valid if the
+        path `p` has at least `b + 1` blocks where the service fits. The reject action is valid if rejection is
+        allowed; if no action is valid otherwise, all actions are marked as valid.
+        """
+        if self._action_masks is None:
+            mask = np.zeros(self.action_space.n, dtype=bool)
+            for idp in range(len(self.k_shortest_paths[self.service.source, self.service.destination])):
+                initial_indices, _ = self.get_available_blocks(idp)
+                mask[idp * self.j:idp * self.j + len(initial_indices)] = True
+            if self.reject_action == 1:
+                mask[self.k_paths * self.j] = True
+            elif not np.any(mask):
+                mask[:] = True
+            self._action_masks = mask
+        return self._action_masks
+
+    def get_available_blocks(self, path):
+        path = self.k_shortest_paths[self.service.source, self.service.destination][path]
+        _, initial_indices, lengths, _, _ = self.get_path_spectrum_summary(path)
+        sufficient_indices = np.flatnonzero(lengths >= self.get_number_slots(path))[:self.j]
+        return initial_indices[sufficient_indices], lengths[sufficient_indices]
 
     def reward(self):
         return 1 if self.service.accepted else -1
@@ -1,21 +1,71 @@
 import gym
-import copy
-import heapq
+import collections
 import random
 import numpy as np
 import networkx as nx
-from optical_rl_gym.utils import Service, Path, get_k_shortest_paths, get_path_weight
+from optical_rl_gym.utils import Service, ServicePool, EventQueue, RunningServices, RunningServiceIds, \
+    LinkRunningServices, NodePairSampler, PhaseProfiler, get_path_index, indexed_topology
+from optical_rl_gym.topology import build_topology
+from optical_rl_gym.traffic import TrafficTrace, generate_traffic
 
 
 class OpticalNetworkEnv(gym.Env):
 
+    traffic_buffer_size = 4096  # number of requests of a traffic trace converted at once to Python scalars
+
+    # whether `running_services` of the graph and of each link hold the ids of the running services (as in the RWA and
+    # QoS environments) or the services themselves (as in the RMSA environments)
+    running_service_ids = False
+
+    # methods timed by `enable_profiling`, and the phase each one is accounted in (methods that an environment does
+    # not have are skipped); the time of `step` not spent in the other phases is accounted in 'other'
+    profiled_methods = {
+        'step': 'other',
+        '_next_service': 'request_generation',
+        '_release_paths': 'release',
+        'is_path_free': 'feasibility',
+        '_is_path_free': 'feasibility',
+        '_provision_path': 'provisioning',
+        '_update_network_stats': 'statistics',
+        '_update_link_stats': 'statistics',
+        '_update_link_compactness_terms': 'statistics',
+        'observation': 'observation',
+    }
+
     def __init__(self, topology=None, episode_length=1000, load=10, mean_service_holding_time=10800.0,
                  num_spectrum_resources=80, allow_rejection=False,
-                 node_request_probabilities=None, seed=None, k_paths=5):
+                 node_request_probabilities=None, seed=None, k_paths=5, service_retention='all',
+                 traffic=None, traffic_chunk_size=None):
         assert topology is None or 'ksp' in topology.graph
         assert topology is None or 'k_paths' in topology.graph
-        self._events = []
+        assert service_retention in ('all', 'none') or callable(service_retention) or \
+            (isinstance(service_retention, int) and not isinstance(service_retention, bool) and service_retention >= 0)
+        # defines which processed services are kept in `topology.graph['services']` and in the `services` list of
+        # each link: 'all' keeps every service, 'none' keeps no service, an integer N keeps only the last N services,
+        # and a callable is called with each processed service (e.g., to stream it to a file) without keeping it
+        self.service_retention = service_retention
+        # services are only recycled when the environment keeps no reference to them after they are processed
+        self._service_pool = ServicePool() if service_retention == 'none' else None
+        # services no longer used by the environment, recycled once the next request has its service
+        self._services_to_recycle = []
+        self._events = EventQueue()
         self.current_time = 0
+        # requests can be read from a pre-generated `TrafficTrace` (`traffic`), which is replayed from the start at
+        # every full reset, and/or drawn in chunks of `traffic_chunk_size` requests by `generate_traffic`, instead of
+        # being drawn one at a time by `_next_service`
+        assert traffic_chunk_size is None or traffic_chunk_size > 0
+        self.traffic = traffic
+        self.traffic_chunk_size = traffic_chunk_size
+        self._traffic_mode = traffic is not None or traffic_chunk_size is not None
+        self._traffic_position = 0
+        self._traffic_rows = []
+        self._traffic_index = 0
+        self.running_services = None
+        # if set to a `TrafficRecorder`, records every request drawn
+        self.traffic_recorder = None
+        # `PhaseProfiler` set by `enable_profiling`
+        self.profiler = None
+        self._profiled_steps = 0
         self.episode_length = episode_length
         self.services_processed = 0
         self.services_accepted = 0
@@ -53,36 +103,33 @@ class OpticalNetworkEnv(gym.Env):
             self.topology.add_edge("C", "E", index=4, weight=1, length=300)
             self.topology.add_edge("D", "E", index=5, weight=1, length=200)
             self.topology.add_edge("D", "F", index=6, weight=1, length=400)
-            self.topology.add_edge("E", "F", index=6, weight=1, length=500)
-            self.topology.graph["node_indices"] = []
-
-            for idx, node in enumerate(self.topology.nodes()):
-                self.topology.graph["node_indices"].append(node)
-            k_shortest_paths = {}
-            idp = 0
-            for idn1, n1 in enumerate(self.topology.nodes()):
-                for idn2, n2 in enumerate(self.topology.nodes()):
-                    if idn1 < idn2:
-                        paths = get_k_shortest_paths(self.topology, n1, n2, k_paths)
-                        # print(n1, n2, len(paths))
-                        lengths = [get_path_weight(self.topology, path) for path in paths]
-                        objs = []
-                        for path, length in zip(paths, lengths):
-                            objs.append(Path(idp, path, length))
-                            idp += 1
-                        k_shortest_paths[n1, n2] = objs
-                        k_shortest_paths[n2, n1] = objs
-
-            self.topology.graph["ksp"] = k_shortest_paths
-            self.k_shortest_paths = k_shortest_paths
-            self.topology.graph['k_paths'] = k_paths
+            self.topology.add_edge("E", "F", index=7, weight=1, length=500)
+            self.topology = build_topology(self.topology, self.topology_name, k_paths=k_paths, weight=None,
+                                           num_workers=1)
+            self.k_shortest_paths = self.topology.graph["ksp"]
             self.k_paths = k_paths
         else:
-            self.topology = copy.deepcopy(topology)
+            # the nodes, k-shortest paths and modulations of indexed topologies (see `build_topology`, `load_topology`
+            # and `indexed_topology`) are shared by all the environments created from them; only the attribute dicts
+            # of the graph and of the links, which hold the state of the environment, are copied. The paths of other
+            # topologies (e.g., unpickled ones) are copied by every environment, so such topologies should be indexed
+            # once with `indexed_topology` before creating many environments from them
+            self.topology = indexed_topology(topology)
             self.topology_name = topology.graph['name']
             self.k_paths = self.topology.graph['k_paths']
             self.k_shortest_paths = self.topology.graph['ksp']  # just as a more convenient way to access it
         assert node_request_probabilities is None or len(node_request_probabilities) == self.topology.number_of_nodes()
+
+        # integer index used in the hot paths instead of walking the node lists of the paths
+        self.paths, self.path_link_incidence = get_path_index(self.topology)
+        self.link_attributes = [None] * self.topology.number_of_edges()
+        for n1, n2 in self.topology.edges():
+            self.link_attributes[self.topology[n1][n2]['index']] = self.topology[n1][n2]
+
+        self._pair_link_incidence = {}
+        # mask of the valid actions for the current service, computed on demand by `action_masks`
+        self._action_masks = None
+
         self.num_spectrum_resources = num_spectrum_resources
         self.topology.graph['num_spectrum_resources'] = num_spectrum_resources
         self.topology.graph['available_spectrum'] = np.full((self.topology.number_of_edges()),
@@ -129,13 +176,74 @@ class OpticalNetworkEnv(gym.Env):
 
     def _add_release(self, service: Service):
         """
-        Adds an event to the event list of the simulator.
-        This implementation is based on the functionalities of heapq: https://docs.python.org/2/library/heapq.html
+        Adds the release of a service to the event queue of the simulator.
 
-        :param event:
+        :param service: the service to be released at the end of its holding time
         :return: None
         """
-        heapq.heappush(self._events, (service.arrival_time + service.holding_time, service))
+        self._events.push(service.arrival_time + service.holding_time, service.service_id)
+
+    def _pop_releases(self) -> list:
+        """
+        Removes from the event queue the releases happening up to the current time.
+
+        :return: the services to be released, in time order
+        """
+        return [self.running_services.get(service_id)
+                for service_id in self._events.pop_ids_until(self.current_time).tolist()]
+
+    def _new_service_log(self):
+        """
+        Creates an empty container for processed services according to the `service_retention` policy.
+        """
+        if self.service_retention == 'all':
+            return []
+        if isinstance(self.service_retention, int):
+            return collections.deque(maxlen=self.service_retention)
+        return collections.deque(maxlen=0)
+
+    def _store_service(self, service: Service):
+        """
+        Records a processed service according to the `service_retention` policy.
+        """
+        self.topology.graph['services'].append(service)
+        if callable(self.service_retention):
+            self.service_retention(service)
+        if self._service_pool is not None and not service.accepted:
+            self._services_to_recycle.append(service)
+
+    def _create_service(self, *args, **kwargs) -> Service:
+        """
+        Creates the service of a new request, recycling a previously processed one when possible.
+        The services rejected or released during the current step are only recycled after the new one is created, so
+        that the service of a step is never reused by the next one.
+        """
+        if self._service_pool is not None:
+            service = self._service_pool.acquire(*args, **kwargs)
+            for released in self._services_to_recycle:
+                self._service_pool.release(released)
+            self._services_to_recycle.clear()
+            return service
+        return Service(*args, **kwargs)
+
+    def _recycle_service(self, service: Service):
+        """
+        Marks a released service as no longer used by the environment.
+        """
+        if self._service_pool is not None:
+            self._services_to_recycle.append(service)
+
+    @property
+    def node_request_probabilities(self):
+        return self._node_request_probabilities
+
+    @node_request_probabilities.setter
+    def node_request_probabilities(self, node_request_probabilities):
+        self._node_request_probabilities = node_request_probabilities
+        self._node_pair_sampler = NodePairSampler(self.topology.nodes(),
+                                                  [self.topology.graph['node_indices'].index(node)
+                                                   for node in self.topology.nodes()],
+                                                  node_request_probabilities)
 
     def _get_node_pair(self):
         """
@@ -143,14 +251,110 @@ class OpticalNetworkEnv(gym.Env):
 
         :return: source node, source node id, destination node, destination node id
         """
-        src = self.rng.choices([x for x in self.topology.nodes()], weights=self.node_request_probabilities)[0]
-        src_id = self.topology.graph['node_indices'].index(src)
-        new_node_probabilities = np.copy(self.node_request_probabilities)
-        new_node_probabilities[src_id] = 0.
-        new_node_probabilities = new_node_probabilities / np.sum(new_node_probabilities)
-        dst = self.rng.choices([x for x in self.topology.nodes()], weights=new_node_probabilities)[0]
-        dst_id = self.topology.graph['node_indices'].index(dst)
-        return src, src_id, dst, dst_id
+        return self._node_pair_sampler.sample(self.rng)
+
+    def get_node_pairs(self, size):
+        """
+        Draws `size` source-destination pairs at once from the random number generator of the environment.
+        The pairs are the same that `size` consecutive calls to `_get_node_pair` would return.
+
+        :return: arrays with the source node ids and the destination node ids
+        """
+        uniforms = np.array([self.rng.random() for _ in range(2 * size)]).reshape((size, 2))
+        return self._node_pair_sampler.sample_ids(uniforms)
+
+    def _traffic_parameters(self):
+        """
+        Returns the parameters of `optical_rl_gym.traffic.generate_traffic` specific to the type of environment.
+        """
+        return {}
+
+    def generate_traffic(self, num_requests, seed=None, start_time=0.) -> TrafficTrace:
+        """
+        Pre-generates `num_requests` requests following the load and the request distributions of the environment.
+        The trace can be passed as the `traffic` argument of several environments to replay the same requests.
+
+        :param num_requests: number of requests to be generated
+        :param seed: seed of the requests; if None, the traffic random number generator of the environment is used
+        :param start_time: time after which the first request arrives
+        :return: the generated trace
+        """
+        random_state = self.traffic_rng if seed is None else np.random.default_rng(seed)
+        return generate_traffic(num_requests, self.mean_service_inter_arrival_time, self.mean_service_holding_time,
+                                self._node_pair_sampler, random_state, start_time=start_time,
+                                **self._traffic_parameters())
+
+    def _next_request(self):
+        """
+        Returns the next pre-generated request, reading the trace in buffers of Python scalars.
+
+        :return: arrival time, holding time, source node, source node id, destination node, destination node id,
+            bit rate and service class of the request
+        """
+        if self._traffic_index == len(self._traffic_rows):
+            if self.traffic is not None and self._traffic_position < len(self.traffic):
+                self._traffic_rows = self.traffic.rows(self._traffic_position,
+                                                       self._traffic_position + self.traffic_buffer_size)
+                self._traffic_position += len(self._traffic_rows)
+            elif self.traffic_chunk_size is not None:
+                chunk = self.generate_traffic(self.traffic_chunk_size, start_time=self.current_time)
+                self._traffic_rows = chunk.rows(0, len(chunk))
+            else:
+                raise ValueError('No more requests in the traffic trace ({} requests)'.format(len(self.traffic)))
+            self._traffic_index = 0
+        at, ht, src_id, dst_id, bit_rate, service_class = self._traffic_rows[self._traffic_index]
+        self._traffic_index += 1
+        node_indices = self.topology.graph['node_indices']
+        return at, ht, node_indices[src_id], src_id, node_indices[dst_id], dst_id, bit_rate, service_class
+
+    def get_pair_link_incidence(self, source, destination) -> np.ndarray:
+        """
+        Returns the boolean (paths x links) incidence matrix of the k shortest paths between two nodes.
+        """
+        incidence = self._pair_link_incidence.get((source, destination))
+        if incidence is None:
+            paths = self.k_shortest_paths[source, destination]
+            incidence = np.zeros((len(paths), self.topology.number_of_edges()), dtype=bool)
+            for idp, path in enumerate(paths):
+                incidence[idp, path.links] = True
+            self._pair_link_incidence[source, destination] = incidence
+        return incidence
+
+    def enable_profiling(self, info_interval: int = None) -> PhaseProfiler:
+        """
+        Starts accumulating the time spent in each phase of the steps (request generation, release, feasibility
+        check, provisioning, statistics update and observation), see `profiled_methods`.
+        The methods are replaced by timed versions on this instance only, so there is no cost while profiling is
+        disabled. The environment cannot be pickled while profiling is enabled.
+
+        :param info_interval: if given, the summary of the profiler is added as `info['profile']` every
+            `info_interval` steps
+        :return: the profiler, whose `summary()` returns the time and number of calls of each phase
+        """
+        self.disable_profiling()
+        self.profiler = PhaseProfiler()
+        self._profiled_steps = 0
+        for name, phase in self.profiled_methods.items():
+            if hasattr(type(self), name):
+                # the feasibility checks done by the heuristics before the step are not accounted
+                setattr(self, name, self.profiler.wrap(phase, getattr(type(self), name).__get__(self),
+                                                       nested_only=phase == 'feasibility'))
+        if info_interval is not None:
+            step = self.step
+
+            def step_with_profile(action):
+                observation, reward, done, info = step(action)
+                self._profiled_steps += 1
+                if self._profiled_steps % info_interval == 0:
+                    info['profile'] = self.profiler.summary()
+                return observation, reward, done, info
+            self.step = step_with_profile
+        return self.profiler
+
+    def disable_profiling(self):
+        for name in self.profiled_methods:
+            self.__dict__.pop(name, None)
+        self.profiler = None
 
     def observation(self):
         return {'topology': self.topology,
@@ -160,8 +364,11 @@ class OpticalNetworkEnv(gym.Env):
         return 1 if self.service.accepted else 0
 
     def reset(self):
-        self._events = []
+        self._events.clear()
         self.current_time = 0
+        self._traffic_position = 0
+        self._traffic_rows = []
+        self._traffic_index = 0
         self.services_processed = 0
         self.services_accepted = 0
         self.episode_services_processed = 0
@@ -171,15 +378,19 @@ class OpticalNetworkEnv(gym.Env):
                                                             fill_value=self.num_spectrum_resources,
                                                             dtype=int)
 
-        self.topology.graph["services"] = []
-        self.topology.graph["running_services"] = []
+        self.topology.graph["services"] = self._new_service_log()
+        # services being carried, also exposed as read-only views in `running_services` of the graph and of each link
+        self.running_services = RunningServices(self.topology.number_of_edges())
+        self.topology.graph["running_services"] = RunningServiceIds(self.running_services) \
+            if self.running_service_ids else self.running_services
 
         self.topology.graph["last_update"] = 0.
         for idx, lnk in enumerate(self.topology.edges()):
             self.topology[lnk[0]][lnk[1]]['utilization'] = 0.
             self.topology[lnk[0]][lnk[1]]['last_update'] = 0.
-            self.topology[lnk[0]][lnk[1]]['services'] = []
-            self.topology[lnk[0]][lnk[1]]['running_services'] = []
+            self.topology[lnk[0]][lnk[1]]['services'] = self._new_service_log()
+            self.topology[lnk[0]][lnk[1]]['running_services'] = LinkRunningServices(
+                self.running_services.links[self.topology[lnk[0]][lnk[1]]['index']], ids=self.running_service_ids)
 
     def seed(self, seed=None):
         if seed is not None:
@@ -187,3 +398,4 @@ class OpticalNetworkEnv(gym.Env):
         else:
             self.rand_seed = 41
         self.rng = random.Random(self.rand_seed)
+        self.traffic_rng = np.random.default_rng(self.rand_seed)
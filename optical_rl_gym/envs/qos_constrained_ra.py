@@ -1,11 +1,9 @@
 import gym
 
-import heapq
 import logging
 import numpy as np
 import matplotlib.pyplot as plt
 
-from optical_rl_gym.utils import Service
 from .optical_network_env import OpticalNetworkEnv
 
 
@@ -14,6 +12,8 @@ class QoSConstrainedRA(OpticalNetworkEnv):
         'metrics': ['service_blocking_rate', 'episode_service_blocking_rate']
     }
 
+    running_service_ids = True
+
     def __init__(self, topology=None,
                  episode_length=1000,
                  load=10,
@@ -25,7 +25,7 @@ class QoSConstrainedRA(OpticalNetworkEnv):
                  node_request_probabilities=None,
                  allow_rejection=True,
                  k_paths=5,
-                 seed=None, reset=True):
+                 seed=None, service_retention='all', traffic=None, traffic_chunk_size=None, reset=True):
         super().__init__(topology=topology,
                          episode_length=episode_length,
                          load=load,
@@ -33,9 +33,13 @@ class QoSConstrainedRA(OpticalNetworkEnv):
                          num_spectrum_resources=num_spectrum_resources,
                          node_request_probabilities=node_request_probabilities,
                          seed=seed,
-                         k_paths=k_paths)
+                         k_paths=k_paths,
+                         service_retention=service_retention,
+                         traffic=traffic,
+                         traffic_chunk_size=traffic_chunk_size)
 
         assert num_service_classes == len(classes_arrival_probabilities)
+        assert traffic is None or traffic.service_class is not None
 
         self.num_service_classes = num_service_classes
         self.classes_arrival_probabilities = classes_arrival_probabilities
@@ -95,7 +99,7 @@ class QoSConstrainedRA(OpticalNetworkEnv):
         self.services_processed += 1
         self.episode_services_processed += 1
 
-        self.topology.graph['services'].append(self.service)
+        self._store_service(self.service)
 
         reward = self.reward()
         info = {
@@ -159,8 +163,7 @@ class QoSConstrainedRA(OpticalNetworkEnv):
         plt.subplot(1, 4, 4)
         paths = np.zeros((self.k_paths, self.topology.number_of_edges()))
         for idp, path in enumerate(self.k_shortest_paths[self.service.source, self.service.destination]):
-            for i in range(len(path.node_list) - 1):
-                paths[idp, self.topology[path.node_list[i]][path.node_list[i + 1]]['index']] = 1
+            paths[idp, path.links] = 1
         plt.pcolor(paths, cmap=plt.cm.Greys, edgecolors='none', linewidth=.01)
         plt.xlabel('path')
         plt.ylabel('node')
@@ -171,28 +174,34 @@ class QoSConstrainedRA(OpticalNetworkEnv):
     def _next_service(self):
         if self._new_service:
             return
-        at = self.current_time + self.rng.expovariate(1 / self.mean_service_inter_arrival_time)
+        if self._traffic_mode:
+            at, ht, src, src_id, dst, dst_id, _, clazz = self._next_request()
+        else:
+            at = self.current_time + self.rng.expovariate(1 / self.mean_service_inter_arrival_time)
+            ht = self.rng.expovariate(1 / self.mean_service_holding_time)
+            src, src_id, dst, dst_id = self._get_node_pair()
+            clazz = self.rng.choices([x for x in range(self.num_service_classes)],
+                                     self.classes_arrival_probabilities)[0]
         self.current_time = at
-
-        ht = self.rng.expovariate(1 / self.mean_service_holding_time)
-        src, src_id, dst, dst_id = self._get_node_pair()
-
-        clazz = self.rng.choices([x for x in range(self.num_service_classes)], self.classes_arrival_probabilities)[0]
+        if self.traffic_recorder is not None:
+            self.traffic_recorder.append(at, ht, src_id, dst_id, service_class=clazz)
 
         # release connections up to this point
-        while len(self._events) > 0:
-            (time, service_to_release) = heapq.heappop(self._events)
-            if time <= self.current_time:
-                self._release_path(service_to_release)
-            else:  # release is not to be processed yet
-                self._add_release(service_to_release)  # puts service back in the queue
-                break  # breaks the look
-
-        self.service = Service(self.episode_services_processed, src, src_id, destination=dst, destination_id=dst_id,
-                               arrival_time=at, holding_time=ht, number_slots=1,
-                               service_class=clazz)
+        services_to_release = self._pop_releases()
+        if len(services_to_release) > 0:
+            self._release_paths(services_to_release)
+            for service_to_release in services_to_release:
+                self._recycle_service(service_to_release)
+
+        self.service = self._create_service(self.services_processed, src, src_id, destination=dst, destination_id=dst_id,
+                                            arrival_time=at, holding_time=ht, number_slots=1,
+                                            service_class=clazz)
+        self._action_masks = None
         self._new_service = True
 
+    def _traffic_parameters(self):
+        return {'classes_arrival_probabilities': self.classes_arrival_probabilities}
+
     def observation(self):
         return {'topology': self.topology,
                 'service': self.service}
@@ -202,27 +211,30 @@ class QoSConstrainedRA(OpticalNetworkEnv):
         if not self._is_path_free(path, self.service.number_slots):
             raise ValueError("Path {} has not enough capacity".format(path.node_list, path))
 
-        for i in range(len(path.node_list) - 1):
-            self.topology.graph['available_spectrum'][self.topology[path.node_list[i]][path.node_list[i + 1]]['index']] -= self.service.number_slots
-            self.topology[path.node_list[i]][path.node_list[i + 1]]['services'].append(self.service.service_id)
-            self.topology[path.node_list[i]][path.node_list[i + 1]]['running_services'].append(self.service.service_id)
-            self._update_link_stats(path.node_list[i], path.node_list[i + 1])
-        self.topology.graph['running_services'].append(self.service.service_id)
-        self._update_network_stats()
+        self.topology.graph['available_spectrum'][path.links] -= self.service.number_slots
         self.service.route = path
+        self.running_services.add(self.service, path.links)
+        for link in path.links:
+            self.link_attributes[link]['services'].append(self.service.service_id)
+            self._update_link_stats(link)
+        self._update_network_stats()
 
     def _release_path(self, service):
-        for i in range(len(service.route.node_list) - 1):
-            self.topology.graph['available_spectrum'][self.topology[service.route.node_list[i]][service.route.node_list[i + 1]]['index']] += service.number_slots
-            try:
-                self.topology[service.route.node_list[i]][service.route.node_list[i + 1]]['running_services'].remove(service.service_id)
-            except:
-                self.logger.warning('error')
-            self._update_link_stats(service.route.node_list[i], service.route.node_list[i + 1])
-        try:
-            self.topology.graph['running_services'].remove(service.service_id)
-        except:
-            self.logger.warning('error')
+        self._release_paths([service])
+
+    def _release_paths(self, services):
+        """
+        Releases several services at once, adding back the spectrum of all of them in a single operation and
+        updating the statistics of each link once, after all the releases.
+        """
+        links = np.concatenate([service.route.links for service in services])
+        np.add.at(self.topology.graph['available_spectrum'], links,
+                  np.repeat([service.number_slots for service in services],
+                            [len(service.route.links) for service in services]))
+        for service in services:
+            self.running_services.remove(service)
+        for link in dict.fromkeys(links.tolist()):
+            self._update_link_stats(link)
 
     def _update_network_stats(self):
         """
@@ -238,16 +250,38 @@ class QoSConstrainedRA(OpticalNetworkEnv):
         #     utilization = ((last_throughput * last_update) + (cur_throughtput * time_diff)) / self.current_time
         #     self.topology.graph['throughput'] = utilization
 
-    def _update_link_stats(self, node1, node2):
-        last_update = self.topology[node1][node2]['last_update']
-        time_diff = self.current_time - self.topology[node1][node2]['last_update']
+    def _update_link_stats(self, link):
+        link_attributes = self.link_attributes[link]
+        last_update = link_attributes['last_update']
+        time_diff = self.current_time - link_attributes['last_update']
         if self.current_time > 0:
-            last_util = self.topology[node1][node2]['utilization']
-            cur_util = (self.num_spectrum_resources - self.topology.graph['available_spectrum'][self.topology[node1][node2]['index']]) / self.num_spectrum_resources
+            last_util = link_attributes['utilization']
+            cur_util = (self.num_spectrum_resources - self.topology.graph['available_spectrum'][link]) / self.num_spectrum_resources
             utilization = ((last_util * last_update) + (cur_util * time_diff)) / self.current_time
-            self.topology[node1][node2]['utilization'] = utilization
+            link_attributes['utilization'] = utilization
 
-        self.topology[node1][node2]['last_update'] = self.current_time
+        link_attributes['last_update'] = self.current_time
+
+    def action_masks(self) -> np.ndarray:
+        """
+        Returns the boolean mask of the valid actions for the current service: action `p` is valid if the path `p`
+        has enough free spectrum on all its links, and services of class 0 can only use the shortest path. The reject
+        action is valid if rejection is allowed; if no action is valid otherwise, all actions are marked as valid.
+        """
+        if self._action_masks is None:
+            incidence = self.get_pair_link_incidence(self.service.source, self.service.destination)
+            if self.service.service_class == 0:
+                incidence = incidence[:1]
+            mask = np.zeros(self.action_space.n, dtype=bool)
+            if self.service.number_slots <= self.num_spectrum_resources:
+                enough = self.topology.graph['available_spectrum'] >= self.service.number_slots
+                mask[:len(incidence)] = np.all(enough[None, :] | ~incidence, axis=1)
+            if self.reject_action == 1:
+                mask[self.k_paths] = True
+            elif not np.any(mask):
+                mask[:] = True
+            self._action_masks = mask
+        return self._action_masks
 
     def _is_path_free(self, path, number_slots):
         return is_path_free(self.topology, path, number_slots)
@@ -262,17 +296,13 @@ class QoSConstrainedRA(OpticalNetworkEnv):
 def is_path_free(topology, path, number_slots):
     if number_slots > topology.graph['num_spectrum_resources']:
         return False
-    for i in range(len(path.node_list) - 1):
-        if topology.graph['available_spectrum'][topology[path.node_list[i]][path.node_list[i + 1]]['index']] < number_slots:
-            return False
+    if np.any(topology.graph['available_spectrum'][path.links] < number_slots):
+        return False
     return True
 
 
 def get_path_capacity(topology, path):
-    capacity = np.finfo(0.0).max
-    for i in range(len(path.node_list) - 1):
-        capacity = min(capacity, topology.graph['available_spectrum'][topology[path.node_list[i]][path.node_list[i + 1]]['index']])
-    return capacity
+    return np.min(topology.graph['available_spectrum'][path.links])
 
 
 def shortest_path(env: QoSConstrainedRA) -> int:
@@ -322,8 +352,7 @@ class MatrixObservationWithPaths(gym.ObservationWrapper):
             observation[edge_id, 0:used_resources] = 1
         for idp, path in enumerate(self.env.topology.graph['ksp'][self.env.service.source, self.env.service.destination]):
             start_index = (idp + 1) * self.env.num_spectrum_resources
-            for i in range(len(path.node_list) - 1):
-                edge_id = self.env.topology.edges[path.node_list[i], path.node_list[i+1]]['index']
+            for edge_id in path.links:
                 resulting_used_resources = self.env.num_spectrum_resources - self.env.topology.graph['available_spectrum'][edge_id] + 1
                 observation[edge_id, start_index:start_index + resulting_used_resources] = 1
             if self.env.service.service_class == 0:
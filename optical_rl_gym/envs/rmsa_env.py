@@ -1,12 +1,11 @@
 import gym
-import copy
 import math
-import heapq
 import logging
-import functools
 import numpy as np
 
 from optical_rl_gym.utils import Service, Path
+from optical_rl_gym.spectrum import slot_range_bitset, bitset_to_slots, bitset_blocks, contiguous_bitset, set_bits, \
+    contiguous_fits, num_words, bitset_to_words, words_to_bitset, SpectrumBlocks
 from .optical_network_env import OpticalNetworkEnv
 
 
@@ -28,6 +27,10 @@ class RMSAEnv(OpticalNetworkEnv):
                  seed=None,
                  k_paths=5,
                  allow_rejection=False,
+                 spectrum_backend='array',
+                 service_retention='all',
+                 traffic=None,
+                 traffic_chunk_size=None,
                  reset=True):
         super().__init__(topology,
                          episode_length=episode_length,
@@ -36,8 +39,12 @@ class RMSAEnv(OpticalNetworkEnv):
                          num_spectrum_resources=num_spectrum_resources,
                          node_request_probabilities=node_request_probabilities,
                          seed=seed, allow_rejection=allow_rejection,
-                         k_paths=k_paths)
+                         k_paths=k_paths,
+                         service_retention=service_retention,
+                         traffic=traffic,
+                         traffic_chunk_size=traffic_chunk_size)
         assert 'modulations' in self.topology.graph
+        assert traffic is None or traffic.bit_rate is not None
         # specific attributes for elastic optical networks
         self.bit_rate_requested = 0
         self.bit_rate_provisioned = 0
@@ -47,8 +54,15 @@ class RMSAEnv(OpticalNetworkEnv):
         self.bit_rate_lower_bound = bit_rate_lower_bound
         self.bit_rate_higher_bound = bit_rate_higher_bound
 
+        # 'array' checks the spectrum on the (E, S) `available_slots` matrix only, while 'bitset' also keeps the
+        # spectrum of the links packed in an (E, ceil(S / 64)) uint64 array, used for path availability and
+        # contiguous block search
+        assert spectrum_backend in ('array', 'bitset')
+        self.spectrum_backend = spectrum_backend
+
         self.spectrum_slots_allocation = np.full((self.topology.number_of_edges(), self.num_spectrum_resources),
                                                  fill_value=-1, dtype=np.int)
+        self._slot_indices = np.arange(self.num_spectrum_resources)
 
         # do we allow proactive rejection or not?
         self.reject_action = 1 if allow_rejection else 0
@@ -110,7 +124,7 @@ class RMSAEnv(OpticalNetworkEnv):
         self.bit_rate_requested += self.service.bit_rate
         self.episode_bit_rate_requested += self.service.bit_rate
 
-        self.topology.graph['services'].append(self.service)
+        self._store_service(self.service)
 
         reward = self.reward()
         info = {
@@ -145,6 +159,25 @@ class RMSAEnv(OpticalNetworkEnv):
         self.bit_rate_provisioned = 0
 
         self.topology.graph["available_slots"] = np.ones((self.topology.number_of_edges(), self.num_spectrum_resources), dtype=int)
+        # blocks of available slots of each link, used to compute the link statistics
+        self.spectrum_blocks = [SpectrumBlocks(self.num_spectrum_resources)
+                                for _ in range(self.topology.number_of_edges())]
+        if self.spectrum_backend == 'bitset':
+            self.topology.graph["available_slots_bitset"] = np.tile(
+                bitset_to_words((1 << self.num_spectrum_resources) - 1, num_words(self.num_spectrum_resources)),
+                (self.topology.number_of_edges(), 1))
+        # version of the spectrum of each link, increased whenever the link changes; a path summary computed by
+        # `get_path_spectrum_summary` is valid while the sum of the versions of its links stays the same
+        self._link_versions = np.zeros(self.topology.number_of_edges(), dtype=int)
+        self._path_spectrum_summaries = {}
+
+        # running aggregates of the network statistics, updated on every provision and release
+        self._running_bit_rate = 0  # sum of the bit rates of the running services
+        self._sum_slots_paths = 0  # sum of number_slots * hops of the running services
+        self._link_occupied = [0] * self.topology.number_of_edges()  # lambda_max - lambda_min of each link
+        self._link_unused_blocks = [0] * self.topology.number_of_edges()  # unused blocks between lambda_min and max
+        self._sum_occupied = 0
+        self._sum_unused_spectrum_blocks = 0
 
         self.spectrum_slots_allocation = np.full((self.topology.number_of_edges(), self.num_spectrum_resources),
                                                  fill_value=-1, dtype=np.int)
@@ -169,18 +202,24 @@ class RMSAEnv(OpticalNetworkEnv):
                                                                                      initial_slot + number_slots))
 
         self.logger.debug('{} assigning path {} on initial slot {} for {} slots'.format(self.service.service_id, path.node_list, initial_slot, number_slots))
-        for i in range(len(path.node_list) - 1):
-            self.topology.graph['available_slots'][self.topology[path.node_list[i]][path.node_list[i + 1]]['index'],
-                                                                        initial_slot:initial_slot + number_slots] = 0
-            self.spectrum_slots_allocation[self.topology[path.node_list[i]][path.node_list[i + 1]]['index'],
-                                                    initial_slot:initial_slot + number_slots] = self.service.service_id
-            self.topology[path.node_list[i]][path.node_list[i + 1]]['services'].append(self.service)
-            self.topology[path.node_list[i]][path.node_list[i + 1]]['running_services'].append(self.service)
-            self._update_link_stats(path.node_list[i], path.node_list[i + 1])
-        self.topology.graph['running_services'].append(self.service)
+        self.topology.graph['available_slots'][path.links, initial_slot:initial_slot + number_slots] = 0
+        self.spectrum_slots_allocation[path.links, initial_slot:initial_slot + number_slots] = self.service.service_id
+        self._link_versions[path.links] += 1
+        for link in path.links:
+            self.spectrum_blocks[link].allocate(initial_slot, number_slots)
+            self._update_link_compactness_terms(link)
+        if self.spectrum_backend == 'bitset':
+            self.topology.graph['available_slots_bitset'][path.links] &= ~self._slot_range_words(initial_slot,
+                                                                                                   number_slots)
         self.service.route = path
         self.service.initial_slot = initial_slot
         self.service.number_slots = number_slots
+        self.running_services.add(self.service, path.links)
+        for link in path.links:
+            self.link_attributes[link]['services'].append(self.service)
+            self._update_link_stats(link)
+        self._running_bit_rate += self.service.bit_rate
+        self._sum_slots_paths += number_slots * path.hops
         self._update_network_stats()
 
         self.services_accepted += 1
@@ -189,15 +228,52 @@ class RMSAEnv(OpticalNetworkEnv):
         self.episode_bit_rate_provisioned += self.service.bit_rate
 
     def _release_path(self, service: Service):
-        for i in range(len(service.route.node_list) - 1):
-            self.topology.graph['available_slots'][
-                self.topology[service.route.node_list[i]][service.route.node_list[i + 1]]['index'],
-                                            service.initial_slot:service.initial_slot + service.number_slots] = 1
-            self.spectrum_slots_allocation[self.topology[service.route.node_list[i]][service.route.node_list[i + 1]]['index'],
-                                            service.initial_slot:service.initial_slot + service.number_slots] = -1
-            self.topology[service.route.node_list[i]][service.route.node_list[i + 1]]['running_services'].remove(service)
-            self._update_link_stats(service.route.node_list[i], service.route.node_list[i + 1])
-        self.topology.graph['running_services'].remove(service)
+        self.topology.graph['available_slots'][service.route.links,
+                                               service.initial_slot:service.initial_slot + service.number_slots] = 1
+        self.spectrum_slots_allocation[service.route.links,
+                                       service.initial_slot:service.initial_slot + service.number_slots] = -1
+        self._link_versions[service.route.links] += 1
+        for link in service.route.links:
+            self.spectrum_blocks[link].release(service.initial_slot, service.number_slots)
+            self._update_link_compactness_terms(link)
+        if self.spectrum_backend == 'bitset':
+            self.topology.graph['available_slots_bitset'][service.route.links] |= \
+                self._slot_range_words(service.initial_slot, service.number_slots)
+        self.running_services.remove(service)
+        for link in service.route.links:
+            self._update_link_stats(link)
+        self._running_bit_rate -= service.bit_rate
+        self._sum_slots_paths -= service.number_slots * service.route.hops
+
+    def _release_paths(self, services: [Service]):
+        """
+        Releases several services at once. The slots of all of them are cleared with a single scatter into the
+        spectrum matrices, and the statistics of each link are updated once, after all the releases.
+        """
+        if len(services) == 1:
+            self._release_path(services[0])
+            return
+        hops = [len(service.route.links) for service in services]
+        links = np.concatenate([service.route.links for service in services])
+        initial_slots = np.repeat([service.initial_slot for service in services], hops)
+        final_slots = initial_slots + np.repeat([service.number_slots for service in services], hops)
+        entries, slots = np.nonzero((self._slot_indices >= initial_slots[:, None]) &
+                                    (self._slot_indices < final_slots[:, None]))
+        self.topology.graph['available_slots'][links[entries], slots] = 1
+        self.spectrum_slots_allocation[links[entries], slots] = -1
+        self._link_versions[links] += 1
+        for service in services:
+            for link in service.route.links:
+                self.spectrum_blocks[link].release(service.initial_slot, service.number_slots)
+            if self.spectrum_backend == 'bitset':
+                self.topology.graph['available_slots_bitset'][service.route.links] |= \
+                    self._slot_range_words(service.initial_slot, service.number_slots)
+            self.running_services.remove(service)
+            self._running_bit_rate -= service.bit_rate
+            self._sum_slots_paths -= service.number_slots * service.route.hops
+        for link in dict.fromkeys(links.tolist()):
+            self._update_link_compactness_terms(link)
+            self._update_link_stats(link)
 
     def _update_network_stats(self):
         last_update = self.topology.graph['last_update']
@@ -206,10 +282,7 @@ class RMSAEnv(OpticalNetworkEnv):
             last_throughput = self.topology.graph['throughput']
             last_compactness = self.topology.graph['compactness']
 
-            cur_throughput = 0.
-
-            for service in self.topology.graph["running_services"]:
-                cur_throughput += service.bit_rate
+            cur_throughput = self._running_bit_rate
 
             throughput = ((last_throughput * last_update) + (cur_throughput * time_diff)) / self.current_time
             self.topology.graph['throughput'] = throughput
@@ -220,88 +293,115 @@ class RMSAEnv(OpticalNetworkEnv):
 
         self.topology.graph['last_update'] = self.current_time
 
-    def _update_link_stats(self, node1: str, node2: str):
-        last_update = self.topology[node1][node2]['last_update']
-        time_diff = self.current_time - self.topology[node1][node2]['last_update']
+    def _update_link_stats(self, link: int):
+        link_attributes = self.link_attributes[link]
+        last_update = link_attributes['last_update']
+        time_diff = self.current_time - link_attributes['last_update']
         if self.current_time > 0:
-            last_util = self.topology[node1][node2]['utilization']
-            cur_util = (self.num_spectrum_resources - np.sum(
-                self.topology.graph['available_slots'][self.topology[node1][node2]['index'], :])) / \
-                       self.num_spectrum_resources
+            last_util = link_attributes['utilization']
+            blocks = self.spectrum_blocks[link]
+            cur_util = (self.num_spectrum_resources - blocks.free_slots) / self.num_spectrum_resources
             utilization = ((last_util * last_update) + (cur_util * time_diff)) / self.current_time
-            self.topology[node1][node2]['utilization'] = utilization
-
-            slot_allocation = self.topology.graph['available_slots'][self.topology[node1][node2]['index'], :]
+            link_attributes['utilization'] = utilization
 
             # implementing fragmentation from https://ieeexplore.ieee.org/abstract/document/6421472
-            last_external_fragmentation = self.topology[node1][node2]['external_fragmentation']
-            last_compactness = self.topology[node1][node2]['compactness']
+            last_external_fragmentation = link_attributes['external_fragmentation']
+            last_compactness = link_attributes['compactness']
 
             cur_external_fragmentation = 0.
             cur_link_compactness = 0.
-            if np.sum(slot_allocation) > 0:
-                initial_indices, values, lengths = RMSAEnv.rle(slot_allocation)
-
+            if blocks.free_slots > 0:
                 # computing external fragmentation from https://ieeexplore.ieee.org/abstract/document/6421472
-                unused_blocks = [i for i, x in enumerate(values) if x == 1]
                 max_empty = 0
-                if len(unused_blocks) > 1 and unused_blocks != [0, len(values) - 1]:
-                    max_empty = max(lengths[unused_blocks])
-                cur_external_fragmentation = 1. - (float(max_empty) / float(np.sum(slot_allocation)))
+                if blocks.num_blocks > 1 and \
+                        not (blocks.num_blocks == 2 and blocks.starts_available() and blocks.ends_available()):
+                    max_empty = blocks.max_length()
+                cur_external_fragmentation = 1. - (float(max_empty) / float(blocks.free_slots))
 
                 # computing link spectrum compactness from https://ieeexplore.ieee.org/abstract/document/6421472
-                used_blocks = [i for i, x in enumerate(values) if x == 0]
-
-                if len(used_blocks) > 1:
-                    lambda_min = initial_indices[used_blocks[0]]
-                    lambda_max = initial_indices[used_blocks[-1]] + lengths[used_blocks[-1]]
-
-                    # evaluate again only the "used part" of the spectrum
-                    internal_idx, internal_values, internal_lengths = RMSAEnv.rle(
-                        slot_allocation[lambda_min:lambda_max])
-                    unused_spectrum_slots = np.sum(1 - internal_values)
-
-                    if unused_spectrum_slots > 0:
-                        cur_link_compactness = ((lambda_max - lambda_min) / np.sum(1 - slot_allocation)) * (
-                                    1 / unused_spectrum_slots)
-                    else:
-                        cur_link_compactness = 1.
+                used_blocks = blocks.num_used_blocks()
+
+                if used_blocks > 1:
+                    lambda_min, lambda_max = blocks.used_range()
+                    cur_link_compactness = ((lambda_max - lambda_min) /
+                                            (self.num_spectrum_resources - blocks.free_slots)) * (1 / used_blocks)
                 else:
                     cur_link_compactness = 1.
 
             external_fragmentation = ((last_external_fragmentation * last_update) + (cur_external_fragmentation * time_diff)) / self.current_time
-            self.topology[node1][node2]['external_fragmentation'] = external_fragmentation
+            link_attributes['external_fragmentation'] = external_fragmentation
 
             link_compactness = ((last_compactness * last_update) + (cur_link_compactness * time_diff)) / self.current_time
-            self.topology[node1][node2]['compactness'] = link_compactness
+            link_attributes['compactness'] = link_compactness
 
-        self.topology[node1][node2]['last_update'] = self.current_time
+        link_attributes['last_update'] = self.current_time
 
     def _next_service(self):
         if self._new_service:
             return
-        at = self.current_time + self.rng.expovariate(1 / self.mean_service_inter_arrival_time)
+        if self._traffic_mode:
+            at, ht, src, src_id, dst, dst_id, bit_rate, _ = self._next_request()
+        else:
+            at = self.current_time + self.rng.expovariate(1 / self.mean_service_inter_arrival_time)
+            ht = self.rng.expovariate(1 / self.mean_service_holding_time)
+            src, src_id, dst, dst_id = self._get_node_pair()
+            bit_rate = self.rng.randint(self.bit_rate_lower_bound, self.bit_rate_higher_bound)
         self.current_time = at
-
-        ht = self.rng.expovariate(1 / self.mean_service_holding_time)
-        src, src_id, dst, dst_id = self._get_node_pair()
-
-        bit_rate = self.rng.randint(self.bit_rate_lower_bound, self.bit_rate_higher_bound)
+        if self.traffic_recorder is not None:
+            self.traffic_recorder.append(at, ht, src_id, dst_id, bit_rate=bit_rate)
 
         # release connections up to this point
-        while len(self._events) > 0:
-            (time, service_to_release) = heapq.heappop(self._events)
-            if time <= self.current_time:
-                self._release_path(service_to_release)
-            else:  # release is not to be processed yet
-                self._add_release(service_to_release)  # puts service back in the queue
-                break  # breaks the loop
-
-        self.service = Service(self.episode_services_processed, src, src_id,
-                               destination=dst, destination_id=dst_id,
-                               arrival_time=at, holding_time=ht, bit_rate=bit_rate)
+        services_to_release = self._pop_releases()
+        if len(services_to_release) > 0:
+            self._release_paths(services_to_release)
+            for service_to_release in services_to_release:
+                self._recycle_service(service_to_release)
+
+        self.service = self._create_service(self.services_processed, src, src_id,
+                                            destination=dst, destination_id=dst_id,
+                                            arrival_time=at, holding_time=ht, bit_rate=bit_rate)
+        self._action_masks = None
         self._new_service = True
 
+    def action_masks(self) -> np.ndarray:
+        """
+        Returns the mask of the valid actions for the current service in the format of MultiDiscrete action masks
+        (e.g., of sb3-contrib's `MaskablePPO`): a flat boolean vector with `sum(action_space.nvec)` elements, the
+        first `action_space.nvec[0]` telling whether each path (or the reject row) has some valid initial slot, and
+        the other `action_space.nvec[1]` whether each initial slot (or the reject column) is valid on some path.
+        Such per-dimension masks cannot express that a path and an initial slot are only valid together, so a
+        masked agent can still pick a pair that does not fit; `joint_action_masks` has the exact mask.
+        """
+        joint = self.joint_action_masks()
+        return np.concatenate((np.any(joint, axis=1), np.any(joint, axis=0)))
+
+    def joint_action_masks(self) -> np.ndarray:
+        """
+        Returns the boolean mask of the valid actions for the current service, with one row per path and one column
+        per initial slot (shape `action_space.nvec`): `mask[p, s]` is True if the service fits on the path `p`
+        starting at slot `s`. The reject action `[k_paths, num_spectrum_resources]` is valid if rejection is
+        allowed; if no action is valid otherwise, all actions are marked as valid.
+        The mask is computed with array operations for all the paths at once, and only once per service.
+        """
+        if self._action_masks is None:
+            paths = self.k_shortest_paths[self.service.source, self.service.destination]
+            incidence = self.get_pair_link_incidence(self.service.source, self.service.destination)
+            path_slots = np.min(np.where(incidence[:, :, None], self.topology.graph['available_slots'][None, :, :], 1),
+                                axis=1)
+            number_slots = np.array([self.get_number_slots(path) for path in paths])
+            mask = np.zeros(tuple(self.action_space.nvec), dtype=bool)
+            mask[:len(paths), :self.num_spectrum_resources] = contiguous_fits(path_slots, number_slots)
+            if self.reject_action == 1:
+                mask[self.k_paths, self.num_spectrum_resources] = True
+            elif not np.any(mask):
+                mask[:] = True
+            self._action_masks = mask
+        return self._action_masks
+
+    def _traffic_parameters(self):
+        return {'bit_rate_lower_bound': self.bit_rate_lower_bound,
+                'bit_rate_higher_bound': self.bit_rate_higher_bound}
+
     def _get_path_slot_id(self, action: int) -> (int, int):
         """
         Decodes the single action index into the path index and the slot index to be used.
@@ -324,19 +424,70 @@ class RMSAEnv(OpticalNetworkEnv):
         if initial_slot + number_slots > self.num_spectrum_resources:
             # logging.debug('error index' + env.parameters.rsa_algorithm)
             return False
-        for i in range(len(path.node_list) - 1):
-            if np.any(self.topology.graph['available_slots'][
-                      self.topology[path.node_list[i]][path.node_list[i + 1]]['index'],
-                      initial_slot:initial_slot + number_slots] == 0):
-                return False
+        if self.spectrum_backend == 'bitset':
+            requested = slot_range_bitset(initial_slot, number_slots)
+            return self.get_available_slots_bitset(path) & requested == requested
+        if np.any(self.topology.graph['available_slots'][path.links, initial_slot:initial_slot + number_slots] == 0):
+            return False
         return True
 
     def get_available_slots(self, path: Path):
-        available_slots = functools.reduce(np.multiply,
-            self.topology.graph["available_slots"][[self.topology[path.node_list[i]][path.node_list[i + 1]]['id']
-                                                    for i in range(len(path.node_list) - 1)], :])
+        if self.spectrum_backend == 'bitset':
+            return bitset_to_slots(self.get_available_slots_bitset(path), self.num_spectrum_resources)
+        available_slots = np.prod(self.topology.graph["available_slots"][path.links, :], axis=0)
         return available_slots
 
+    def get_feasible_initial_slots(self, path: Path, number_slots: int) -> np.ndarray:
+        """
+        Finds all the initial slots where `number_slots` contiguous slots are available across all the links of the path.
+
+        :param path: the path to be evaluated
+        :param number_slots: the number of contiguous slots requested
+        :return: array with the feasible initial slots in increasing order
+        """
+        if number_slots > self.num_spectrum_resources:
+            return np.zeros(0, dtype=int)
+        if self.spectrum_backend == 'bitset':
+            return set_bits(contiguous_bitset(self.get_available_slots_bitset(path), number_slots))
+        # sliding window over the slots available in the path: the window starting at slot s
+        # is feasible if the sum of its slots equals the number of slots requested
+        cumulative = np.zeros(self.num_spectrum_resources + 1, dtype=int)
+        np.cumsum(np.min(self.topology.graph['available_slots'][path.links, :], axis=0), out=cumulative[1:])
+        return np.flatnonzero(cumulative[number_slots:] - cumulative[:-number_slots] == number_slots)
+
+    def get_available_slots_bitset(self, path: Path) -> int:
+        """
+        Returns the slots available across all the links of the path as a bitset (see `optical_rl_gym.spectrum`).
+        Only available when `spectrum_backend='bitset'`.
+        """
+        return words_to_bitset(np.bitwise_and.reduce(self.topology.graph['available_slots_bitset'][path.links]))
+
+    def _slot_range_words(self, initial_slot: int, number_slots: int) -> np.ndarray:
+        return bitset_to_words(slot_range_bitset(initial_slot, number_slots), num_words(self.num_spectrum_resources))
+
+    def get_path_spectrum_summary(self, path: Path) -> (np.ndarray, np.ndarray, np.ndarray, int, float):
+        """
+        Summarizes the spectrum available across all the links of the path.
+        Summaries are cached and only recomputed after a link of the path changes.
+
+        :return: available slots, initial indices and lengths of the available blocks, total number of available
+            slots, and mean length of the available blocks (nan if there is none)
+        """
+        key = self._link_versions[path.links].sum()
+        cached = self._path_spectrum_summaries.get(path.path_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        available_slots = self.get_available_slots(path)
+        if self.spectrum_backend == 'bitset':
+            initial_indices, lengths = bitset_blocks(self.get_available_slots_bitset(path))
+        else:
+            initial_indices, values, lengths = RMSAEnv.rle(available_slots)
+            initial_indices, lengths = initial_indices[values == 1], lengths[values == 1]
+        summary = (available_slots, initial_indices, lengths, np.sum(available_slots),
+                   np.mean(lengths) if len(lengths) > 0 else np.nan)
+        self._path_spectrum_summaries[path.path_id] = (key, summary)
+        return summary
+
     def rle(inarray):
         """ run length encoding. Partial credit to R rle function.
             Multi datatype arrays catered for including non Numpy
@@ -354,6 +505,12 @@ class RMSAEnv(OpticalNetworkEnv):
             return p, ia[i], z
 
     def get_available_blocks(self, path):
+        if self.spectrum_backend == 'bitset':
+            path = self.k_shortest_paths[self.service.source, self.service.destination][path]
+            initial_indices, lengths = bitset_blocks(self.get_available_slots_bitset(path))
+            sufficient_indices = np.where(lengths >= self.get_number_slots(path))[0][:self.j]
+            return initial_indices[sufficient_indices], lengths[sufficient_indices]
+
         # get available slots across the whole path
         # 1 if slot is available across all the links
         # zero if not
@@ -378,59 +535,60 @@ class RMSAEnv(OpticalNetworkEnv):
 
         return initial_indices[final_indices], lengths[final_indices]
 
+    def _update_link_compactness_terms(self, link: int):
+        """
+        Updates the contribution of the link to the network spectrum compactness after its spectrum changed.
+        """
+        occupied, unused_blocks = 0, 0
+        used_blocks = self.spectrum_blocks[link].num_used_blocks()
+        if used_blocks > 1:
+            lambda_min, lambda_max = self.spectrum_blocks[link].used_range()
+            occupied = lambda_max - lambda_min
+            unused_blocks = used_blocks - 1
+        self._sum_occupied += occupied - self._link_occupied[link]
+        self._sum_unused_spectrum_blocks += unused_blocks - self._link_unused_blocks[link]
+        self._link_occupied[link] = occupied
+        self._link_unused_blocks[link] = unused_blocks
+
     def _get_network_compactness(self):
         # implementing network spectrum compactness from https://ieeexplore.ieee.org/abstract/document/6476152
 
-        sum_slots_paths = 0  # this accounts for the sum of all Bi * Hi
-
-        for service in self.topology.graph["running_services"]:
-            sum_slots_paths += service.number_slots * service.route.hops
-
-        # this accounts for the sum of used blocks, i.e.,
-        # \sum_{j=1}^{M} (\lambda_{max}^j - \lambda_{min}^j)
-        sum_occupied = 0
-
-        # this accounts for the number of unused blocks \sum_{j=1}^{M} K_j
-        sum_unused_spectrum_blocks = 0
-
-        for n1, n2 in self.topology.edges():
-            # getting the blocks
-            initial_indices, values, lengths = \
-                RMSAEnv.rle(self.topology.graph['available_slots'][self.topology[n1][n2]['index'], :])
-            used_blocks = [i for i, x in enumerate(values) if x == 0]
-            if len(used_blocks) > 1:
-                lambda_min = initial_indices[used_blocks[0]]
-                lambda_max = initial_indices[used_blocks[-1]] + lengths[used_blocks[-1]]
-                sum_occupied += lambda_max - lambda_min  # we do not put the "+1" because we use zero-indexed arrays
-
-                # evaluate again only the "used part" of the spectrum
-                internal_idx, internal_values, internal_lengths = RMSAEnv.rle(
-                    self.topology.graph['available_slots'][self.topology[n1][n2]['index'], lambda_min:lambda_max])
-                sum_unused_spectrum_blocks += np.sum(internal_values)
-
-        if sum_unused_spectrum_blocks > 0:
-            cur_spectrum_compactness = (sum_occupied / sum_slots_paths) * (self.topology.number_of_edges() /
-                                                                           sum_unused_spectrum_blocks)
+        # the sum of all Bi * Hi, the sum of used blocks, i.e., \sum_{j=1}^{M} (\lambda_{max}^j - \lambda_{min}^j),
+        # and the number of unused blocks \sum_{j=1}^{M} K_j are maintained by `_update_link_compactness_terms`
+        if self._sum_unused_spectrum_blocks > 0:
+            cur_spectrum_compactness = (self._sum_occupied / self._sum_slots_paths) * \
+                                       (self.topology.number_of_edges() / self._sum_unused_spectrum_blocks)
         else:
             cur_spectrum_compactness = 1.
 
         return cur_spectrum_compactness
 
 
+def get_first_fit_slot(env: RMSAEnv, path: Path, num_slots: int) -> int:
+    """
+    Returns the lowest initial slot where the path fits `num_slots` slots, or -1 if there is none.
+    Keeps the search range of the original heuristics, which does not try the last feasible initial slot.
+    """
+    initial_slots = env.get_feasible_initial_slots(path, num_slots)
+    if len(initial_slots) > 0 and initial_slots[0] < env.num_spectrum_resources - num_slots:
+        return initial_slots[0]
+    return -1
+
+
 def shortest_path_first_fit(env: RMSAEnv) -> int:
     num_slots = env.get_number_slots(env.k_shortest_paths[env.service.source, env.service.destination][0])
-    for initial_slot in range(0, env.topology.graph['num_spectrum_resources'] - num_slots):
-        if env.is_path_free(env.k_shortest_paths[env.service.source, env.service.destination][0], initial_slot, num_slots):
-            return [0, initial_slot]
+    initial_slot = get_first_fit_slot(env, env.k_shortest_paths[env.service.source, env.service.destination][0], num_slots)
+    if initial_slot >= 0:
+        return [0, initial_slot]
     return [env.topology.graph['k_paths'], env.topology.graph['num_spectrum_resources']]
 
 
 def shortest_available_path_first_fit(env: RMSAEnv) -> int:
     for idp, path in enumerate(env.k_shortest_paths[env.service.source, env.service.destination]):
         num_slots = env.get_number_slots(path)
-        for initial_slot in range(0, env.topology.graph['num_spectrum_resources'] - num_slots):
-            if env.is_path_free(path, initial_slot, num_slots):
-                return [idp, initial_slot]
+        initial_slot = get_first_fit_slot(env, path, num_slots)
+        if initial_slot >= 0:
+            return [idp, initial_slot]
     return [env.topology.graph['k_paths'], env.topology.graph['num_spectrum_resources']]
 
 
@@ -439,35 +597,46 @@ def least_loaded_path_first_fit(env: RMSAEnv) -> int:
     action = [env.topology.graph['k_paths'], env.topology.graph['num_spectrum_resources']]
     for idp, path in enumerate(env.k_shortest_paths[env.service.source, env.service.destination]):
         num_slots = env.get_number_slots(path)
-        for initial_slot in range(0, env.topology.graph['num_spectrum_resources'] - num_slots):
-            if env.is_path_free(path, initial_slot, num_slots):
-                free_slots = np.sum(env.get_available_slots(path))
-                if free_slots > max_free_slots:
-                    action = [idp, initial_slot]
-                    max_free_slots = free_slots
-                break # breaks the loop for the initial slot
+        initial_slot = get_first_fit_slot(env, path, num_slots)
+        if initial_slot >= 0:
+            free_slots = np.sum(env.get_available_slots(path))
+            if free_slots > max_free_slots:
+                action = [idp, initial_slot]
+                max_free_slots = free_slots
     return action
 
 
 class SimpleMatrixObservation(gym.ObservationWrapper):
 
-    def __init__(self, env: RMSAEnv):
+    def __init__(self, env: RMSAEnv, copy: bool = True):
+        """
+        :param env: the environment to be wrapped
+        :param copy: if False, each observation is a read-only view of a buffer that is overwritten at every step,
+            which avoids allocating a new array per step
+        """
         super().__init__(env)
         shape = self.env.topology.number_of_nodes() * 2 \
                 + self.env.topology.number_of_edges() * self.env.num_spectrum_resources
         self.observation_space = gym.spaces.Box(low=0, high=1, dtype=np.uint8, shape=(shape,))
         self.action_space = env.action_space
+        self.copy = copy
+        # the observation is written in place: source/destination one-hot encodings followed by the spectrum
+        self._buffer = np.zeros(shape, dtype=np.uint8)
+        self._source_destination = self._buffer[:2 * self.env.topology.number_of_nodes()]
+        self._spectrum = self._buffer[2 * self.env.topology.number_of_nodes():] \
+            .reshape((self.env.topology.number_of_edges(), self.env.num_spectrum_resources))
+        self._view = self._buffer.view()
+        self._view.flags.writeable = False
 
     def observation(self, observation):
-        source_destination_tau = np.zeros((2, self.env.topology.number_of_nodes()))
-        min_node = min(self.env.service.source_id, self.env.service.destination_id)
-        max_node = max(self.env.service.source_id, self.env.service.destination_id)
-        source_destination_tau[0, min_node] = 1
-        source_destination_tau[1, max_node] = 1
-        spectrum_obs = copy.deepcopy(self.topology.graph["available_slots"])
-        return np.concatenate((source_destination_tau.reshape((1, np.prod(source_destination_tau.shape))),
-                               spectrum_obs.reshape((1, np.prod(spectrum_obs.shape)))), axis=1)\
-                            .reshape(self.observation_space.shape)
+        self._source_destination[:] = 0
+        self._source_destination[min(self.env.service.source_id, self.env.service.destination_id)] = 1
+        self._source_destination[self.env.topology.number_of_nodes() +
+                                 max(self.env.service.source_id, self.env.service.destination_id)] = 1
+        self._spectrum[:] = self.topology.graph["available_slots"]
+        if self.copy:
+            return self._buffer.copy()
+        return self._view
 
 
 class PathOnlyFirstFitAction(gym.ActionWrapper):
@@ -479,13 +648,10 @@ class PathOnlyFirstFitAction(gym.ActionWrapper):
 
     def action(self, action):
         if action < self.env.k_paths:
-            num_slots = self.env.get_number_slots(self.env.k_shortest_paths[self.env.service.source,
-                                                                            self.env.service.destination][action])
-            for initial_slot in range(0, self.env.topology.graph['num_spectrum_resources'] - num_slots):
-                if self.env.is_path_free(self.env.k_shortest_paths[self.env.service.source,
-                                                                   self.env.service.destination][action],
-                                        initial_slot, num_slots):
-                    return [action, initial_slot]
+            path = self.env.k_shortest_paths[self.env.service.source, self.env.service.destination][action]
+            initial_slot = get_first_fit_slot(self.env, path, self.env.get_number_slots(path))
+            if initial_slot >= 0:
+                return [action, initial_slot]
         return [self.env.topology.graph['k_paths'], self.env.topology.graph['num_spectrum_resources']]
 
     def step(self, action):
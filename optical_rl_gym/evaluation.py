@@ -0,0 +1,174 @@
+"""
+Evaluates heuristics and trained agents over many independent episodes in a process pool.
+
+Each episode runs in a new environment seeded from its own child of a `numpy.random.SeedSequence` built from a root
+seed, so results do not depend on the number of workers or on the order in which episodes are scheduled, and all
+heuristics are evaluated over the same traffic in each episode (common random numbers), as the random generator of
+the environments is only used to draw the traffic.
+As a new environment starts with an empty network, each episode is preceded by warm-up requests, served by the same
+heuristic and left out of the results, so that the network is loaded when the measured episode starts.
+"""
+import os
+import statistics
+import concurrent.futures
+import gym
+import numpy as np
+
+from optical_rl_gym.utils import indexed_topology
+
+DEFAULT_METRICS = ('episode_service_blocking_rate', 'episode_bit_rate_blocking_rate')
+
+_worker_setup = None
+
+
+def _init_worker(setup):
+    global _worker_setup
+    _worker_setup = setup
+
+
+def episode_seeds(seed, n_eval_episodes) -> list:
+    """
+    Returns the seeds of the environments of `n_eval_episodes` episodes, derived from the root `seed`.
+    """
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(n_eval_episodes)]
+
+
+def _policy_name(policy) -> str:
+    return getattr(policy, '__name__', type(policy).__name__)
+
+
+def _action(policy, env, observation):
+    """
+    Returns the action of a heuristic (called with the environment) or of an agent (called with the observation).
+    """
+    if hasattr(policy, 'predict'):
+        return policy.predict(observation, deterministic=True)[0]
+    return policy(env)
+
+
+def _run_episode(policy, seed, point_kwargs, setup=None):
+    env_id, topology, env_kwargs, metrics, warmup_requests, wrapper = setup if setup is not None else _worker_setup
+    env = gym.make(env_id, topology=topology, seed=seed, **env_kwargs, **point_kwargs)
+    if wrapper is not None:
+        env = wrapper(env)
+    observation = env.reset()
+    if warmup_requests is None:
+        warmup_requests = env.unwrapped.episode_length
+    for _ in range(warmup_requests):
+        observation, _, _, _ = env.step(_action(policy, env, observation))
+    # only the counters are reset, so the measured episode starts with the services of the warm-up running
+    observation = env.reset()
+    done, info = False, {}
+    episode_reward, episode_length = 0., 0
+    while not done:
+        observation, reward, done, info = env.step(_action(policy, env, observation))
+        episode_reward += reward
+        episode_length += 1
+    env.close()
+    return episode_reward, episode_length, [info.get(metric, np.nan) for metric in metrics]
+
+
+def evaluate_heuristics(env_id, heuristics, topology, env_kwargs=None, n_eval_episodes=10, seed=None,
+                        metrics=DEFAULT_METRICS, num_workers=None, warmup_requests=None, wrapper=None) -> dict:
+    """
+    Evaluates each heuristic over `n_eval_episodes` episodes, running the episodes in a process pool.
+    Episode `j` of every heuristic is run in a new environment created with the `j`-th seed of `episode_seeds`,
+    after `warmup_requests` requests; with the default warm-up of one episode, it is the second episode of
+    `optical_rl_gym.utils.evaluate_heuristic` on that environment.
+
+    :param env_id: id of the registered environment, e.g., 'RMSA-v0'
+    :param heuristics: list of picklable (e.g., module-level) functions receiving the environment and returning an
+        action, as in `optical_rl_gym.utils.evaluate_heuristic`, or of agents with a
+        `predict(observation, deterministic=True)` method returning the action first (e.g., stable-baselines models)
+    :param topology: topology of the environments
+    :param env_kwargs: other keyword arguments of the environments
+    :param n_eval_episodes: number of episodes per heuristic
+    :param seed: root seed; if None, fresh entropy is drawn from the OS
+    :param metrics: keys of the info of the last step of each episode returned for each episode (NaN if missing)
+    :param num_workers: number of processes (default: number of CPUs); 1 runs the episodes in the calling process
+    :param warmup_requests: number of requests served before each episode and left out of the results; defaults to
+        the episode length of the environment
+    :param wrapper: picklable callable applied to each environment, e.g., the observation wrapper an agent was
+        trained with
+    :return: dict with `rewards` and `lengths`, and one entry per metric, each an array of shape
+        (len(heuristics), n_eval_episodes), and `seeds` with the seed of each episode
+    """
+    seeds = episode_seeds(seed, n_eval_episodes)
+    tasks = [(heuristic, episode_seed, {}) for heuristic in heuristics for episode_seed in seeds]
+    results = _run_episodes(env_id, topology, env_kwargs, metrics, warmup_requests, wrapper, tasks, num_workers)
+    shape = (len(heuristics), n_eval_episodes)
+    evaluation = {key: values.reshape(shape) for key, values in results.items()}
+    evaluation['seeds'] = np.array(seeds, dtype=np.uint32)
+    return evaluation
+
+
+def _run_episodes(env_id, topology, env_kwargs, metrics, warmup_requests, wrapper, tasks, num_workers) -> dict:
+    """
+    Runs the episodes of the `(heuristic or agent, seed, environment keyword arguments)` tasks.
+
+    :return: dict with `rewards`, `lengths` and one entry per metric, each a 1D array in the order of the tasks
+    """
+    # the paths are indexed once here, so the environments of all the episodes share them instead of copying them
+    setup = (env_id, indexed_topology(topology), dict(env_kwargs or {}), tuple(metrics), warmup_requests, wrapper)
+    num_workers = num_workers if num_workers is not None else os.cpu_count()
+    if num_workers <= 1:
+        results = [_run_episode(*task, setup=setup) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker,
+                                                    initargs=(setup,)) as executor:
+            results = list(executor.map(_run_episode, *zip(*tasks),
+                                        chunksize=max(1, len(tasks) // (4 * num_workers))))
+    values = np.array([result[2] for result in results], dtype=float).reshape((len(tasks), len(metrics)))
+    episodes = {'rewards': np.array([result[0] for result in results]),
+                'lengths': np.array([result[1] for result in results], dtype=int)}
+    for idm, metric in enumerate(metrics):
+        episodes[metric] = values[:, idm]
+    return episodes
+
+
+def load_sweep(env_id, heuristics, topology, loads, env_kwargs=None, load_argument='load', n_eval_episodes=10,
+               seed=None, metrics=DEFAULT_METRICS, confidence=0.95, num_workers=None, warmup_requests=None,
+               wrapper=None) -> dict:
+    """
+    Evaluates each heuristic at each load, e.g., to plot blocking probability vs load curves.
+    All the points run in the same process pool, which receives the topology once, and episode `j` of every point
+    uses the `j`-th seed of `episode_seeds`, so the heuristics are compared over the same traffic at each load.
+
+    :param env_id: id of the registered environment, e.g., 'RMSA-v0'
+    :param heuristics: list of picklable functions receiving the environment and returning an action, or of agents
+        with a `predict(observation, deterministic=True)` method (see `evaluate_heuristics`)
+    :param topology: topology of the environments
+    :param loads: values of the load
+    :param env_kwargs: other keyword arguments of the environments
+    :param load_argument: keyword argument of the environments receiving the load (e.g.,
+        'mean_service_inter_arrival_time' for 'DeepRMSA-v0')
+    :param n_eval_episodes: number of episodes per heuristic and load
+    :param seed: root seed; if None, fresh entropy is drawn from the OS
+    :param metrics: keys of the info of the last step of each episode (NaN if missing)
+    :param confidence: confidence level of the intervals
+    :param num_workers: number of processes (default: number of CPUs); 1 runs the episodes in the calling process
+    :param warmup_requests: number of requests served before each episode and left out of the results, so that the
+        blocking is measured on a loaded network; defaults to the episode length of the environment
+    :param wrapper: picklable callable applied to each environment, e.g., the observation wrapper an agent was
+        trained with
+    :return: dict with `loads`, `heuristics` (names), `seeds`, the per-episode `rewards`, `lengths` and metrics as
+        arrays of shape (len(heuristics), len(loads), n_eval_episodes), and `mean` and `half_width` dicts from each
+        metric to arrays of shape (len(heuristics), len(loads)) with the mean over the episodes and the half width of
+        its normal-approximation confidence interval
+    """
+    seeds = episode_seeds(seed, n_eval_episodes)
+    tasks = [(heuristic, episode_seed, {load_argument: load})
+             for heuristic in heuristics for load in loads for episode_seed in seeds]
+    results = _run_episodes(env_id, topology, env_kwargs, metrics, warmup_requests, wrapper, tasks, num_workers)
+    shape = (len(heuristics), len(loads), n_eval_episodes)
+    sweep = {key: values.reshape(shape) for key, values in results.items()}
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    sweep['mean'], sweep['half_width'] = {}, {}
+    for metric in metrics:
+        sweep['mean'][metric] = np.mean(sweep[metric], axis=2)
+        sweep['half_width'][metric] = z * np.std(sweep[metric], axis=2, ddof=1) / np.sqrt(n_eval_episodes) \
+            if n_eval_episodes > 1 else np.full(shape[:2], np.nan)
+    sweep['loads'] = np.asarray(loads)
+    sweep['heuristics'] = [_policy_name(heuristic) for heuristic in heuristics]
+    sweep['seeds'] = np.array(seeds, dtype=np.uint32)
+    return sweep
@@ -0,0 +1,179 @@
+"""
+Helpers to represent the spectrum of a link or path as a packed bitset.
+The bitset is a Python integer where bit `s` is set if slot `s` is available.
+Python integers are arbitrary-precision, so the operations below shift and AND whole machine words at once
+for any number of spectrum slots.
+The spectrum of the links is stored as an array of little-endian uint64 words (slot `s` in bit `s % 64` of word
+`s // 64`), which converts to and from a bitset without copying bit by bit (see `words_to_bitset`).
+"""
+import bisect
+import numpy as np
+
+
+def bitset_to_slots(bits: int, num_slots: int) -> np.ndarray:
+    """
+    Unpacks a bitset into an array of 0/1 slots with `num_slots` elements.
+    """
+    packed = np.frombuffer(bits.to_bytes((num_slots + 7) // 8, 'little'), dtype=np.uint8)
+    return np.unpackbits(packed, bitorder='little')[:num_slots].astype(int)
+
+
+def num_words(num_slots: int) -> int:
+    """
+    Returns the number of uint64 words needed to store `num_slots` slots.
+    """
+    return (num_slots + 63) // 64
+
+
+def bitset_to_words(bits: int, num_words: int) -> np.ndarray:
+    """
+    Packs a bitset into an array of `num_words` little-endian uint64 words.
+    """
+    return np.frombuffer(bits.to_bytes(num_words * 8, 'little'), dtype='<u8')
+
+
+def words_to_bitset(words: np.ndarray) -> int:
+    """
+    Unpacks an array of little-endian uint64 words into a bitset.
+    """
+    return int.from_bytes(np.asarray(words, dtype='<u8').tobytes(), 'little')
+
+
+def slot_range_bitset(initial_slot: int, number_slots: int) -> int:
+    """
+    Returns the bitset with slots `initial_slot` to `initial_slot + number_slots - 1` set.
+    """
+    return ((1 << int(number_slots)) - 1) << int(initial_slot)
+
+
+def contiguous_bitset(bits: int, number_slots: int) -> int:
+    """
+    Returns a bitset where bit `s` is set if slots `s` to `s + number_slots - 1` are all set in `bits`,
+    i.e., the initial slots where a request of `number_slots` slots fits.
+    Takes O(log(number_slots)) shift/AND operations.
+    """
+    length = 1
+    while length * 2 <= number_slots:
+        bits &= bits >> length
+        length *= 2
+    if length < number_slots:
+        bits &= bits >> (number_slots - length)
+    return bits
+
+
+def set_bits(bits: int) -> np.ndarray:
+    """
+    Returns the indices of the set bits in increasing order.
+    """
+    return np.flatnonzero(bitset_to_slots(bits, bits.bit_length()))
+
+
+def bitset_blocks(bits: int) -> (np.ndarray, np.ndarray):
+    """
+    Returns the initial indices and the lengths of the blocks of contiguous set bits.
+    """
+    initial_indices = set_bits(bits & ~(bits << 1))
+    final_indices = set_bits(bits & ~(bits >> 1))
+    return initial_indices, final_indices - initial_indices + 1
+
+
+def contiguous_fits(available_slots: np.ndarray, number_slots) -> np.ndarray:
+    """
+    Array counterpart of `contiguous_bitset` for several spectra at once (e.g., one per candidate path).
+
+    :param available_slots: (..., S) array with 1 where the slot is available
+    :param number_slots: (...) array with the number of contiguous slots requested on each spectrum
+    :return: boolean (..., S) array, True at the initial slots where the requested slots are all available
+    """
+    num_slots = available_slots.shape[-1]
+    cumulative = np.zeros(available_slots.shape[:-1] + (num_slots + 1,), dtype=int)
+    np.cumsum(available_slots, axis=-1, out=cumulative[..., 1:])
+    number_slots = np.asarray(number_slots)[..., None]
+    ends = np.arange(num_slots) + number_slots
+    window = np.take_along_axis(cumulative, np.minimum(ends, num_slots), axis=-1) - cumulative[..., :num_slots]
+    return (ends <= num_slots) & (window == number_slots)
+
+
+class SpectrumBlocks:
+    """
+    Blocks of contiguous available slots of a link, updated incrementally as slot ranges are allocated and
+    released. Each update only touches the blocks adjacent to the changed range.
+    """
+
+    def __init__(self, num_slots: int):
+        self.num_slots = num_slots
+        self.free_slots = num_slots
+        self.initial_indices = [0]  # sorted initial slot of each block
+        self.lengths = {0: num_slots}  # length of the block starting at each initial slot
+
+    def allocate(self, initial_slot: int, number_slots: int):
+        """
+        Marks as used a range of slots, which must lie inside one of the available blocks.
+        """
+        initial_slot, number_slots = int(initial_slot), int(number_slots)
+        idx = bisect.bisect_right(self.initial_indices, initial_slot) - 1
+        start = self.initial_indices[idx]
+        end = start + self.lengths.pop(start)
+        new_blocks = []
+        if start < initial_slot:
+            new_blocks.append(start)
+            self.lengths[start] = initial_slot - start
+        if initial_slot + number_slots < end:
+            new_blocks.append(initial_slot + number_slots)
+            self.lengths[initial_slot + number_slots] = end - initial_slot - number_slots
+        self.initial_indices[idx:idx + 1] = new_blocks
+        self.free_slots -= number_slots
+
+    def release(self, initial_slot: int, number_slots: int):
+        """
+        Marks as available a range of used slots, merging it with the adjacent available blocks.
+        """
+        initial_slot, number_slots = int(initial_slot), int(number_slots)
+        start, end = initial_slot, initial_slot + number_slots
+        first = last = bisect.bisect_left(self.initial_indices, initial_slot)
+        if first > 0 and self.initial_indices[first - 1] + self.lengths[self.initial_indices[first - 1]] == start:
+            first -= 1
+            start = self.initial_indices[first]
+            del self.lengths[start]
+        if last < len(self.initial_indices) and self.initial_indices[last] == end:
+            end += self.lengths.pop(end)
+            last += 1
+        self.initial_indices[first:last] = [start]
+        self.lengths[start] = end - start
+        self.free_slots += number_slots
+
+    @property
+    def num_blocks(self) -> int:
+        return len(self.initial_indices)
+
+    def max_length(self) -> int:
+        return max(self.lengths.values(), default=0)
+
+    def starts_available(self) -> bool:
+        """
+        Whether the first slot of the spectrum is available.
+        """
+        return len(self.initial_indices) > 0 and self.initial_indices[0] == 0
+
+    def ends_available(self) -> bool:
+        """
+        Whether the last slot of the spectrum is available.
+        """
+        return len(self.initial_indices) > 0 and \
+            self.initial_indices[-1] + self.lengths[self.initial_indices[-1]] == self.num_slots
+
+    def num_used_blocks(self) -> int:
+        """
+        Number of blocks of contiguous used slots.
+        """
+        if self.free_slots == self.num_slots:
+            return 0
+        return len(self.initial_indices) + 1 - self.starts_available() - self.ends_available()
+
+    def used_range(self) -> (int, int):
+        """
+        Returns the first used slot and one past the last used slot.
+        """
+        lambda_min = self.lengths[0] if self.starts_available() else 0
+        lambda_max = self.initial_indices[-1] if self.ends_available() else self.num_slots
+        return lambda_min, lambda_max
@@ -0,0 +1,133 @@
+"""
+Single-file container for named NumPy arrays, used to store traffic traces.
+
+The file starts with a fixed header (magic bytes, format version and length of the JSON description), followed by
+the JSON description (kind of content, user metadata, and name, dtype, shape and offset of each array) and by the
+raw little-endian data of each array, aligned to `ALIGNMENT` bytes.
+Arrays are read with `np.frombuffer` on top of a memory map (or any other buffer), so loading does not parse or copy
+the data, and processes mapping the same file share the same physical pages.
+"""
+import json
+import struct
+import numpy as np
+
+MAGIC = b'ORLGYMAR'
+VERSION = 1
+ALIGNMENT = 64
+_HEADER = struct.Struct('<8sII')  # magic, version, length of the JSON description
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def encode_arrays(arrays: dict, kind: str, metadata: dict = None) -> (bytes, list):
+    """
+    Computes the header and the layout of a container with the given arrays.
+
+    :param arrays: dict from name to array
+    :param kind: kind of content, checked when loading
+    :param metadata: JSON-serializable dict stored along with the arrays
+    :return: the header bytes and a list with the offset and the little-endian contiguous version of each array
+    """
+    arrays = {name: np.ascontiguousarray(array, dtype=np.asarray(array).dtype.newbyteorder('<'))
+              for name, array in arrays.items()}
+    description = {'kind': kind, 'metadata': metadata if metadata is not None else {}, 'arrays': []}
+    # offsets depend on the length of the description, which depends on the offsets
+    data_offset = 0
+    while True:
+        offset = data_offset
+        description['arrays'] = []
+        layout = []
+        for name, array in arrays.items():
+            description['arrays'].append({'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape),
+                                          'offset': offset})
+            layout.append((offset, array))
+            offset = _align(offset + array.nbytes)
+        encoded = json.dumps(description).encode('utf-8')
+        if _align(_HEADER.size + len(encoded)) <= data_offset:
+            break
+        data_offset = _align(_HEADER.size + len(encoded))
+    header = _HEADER.pack(MAGIC, VERSION, len(encoded)) + encoded
+    return header, layout
+
+
+def container_size(header: bytes, layout: list) -> int:
+    """
+    Returns the number of bytes of a container with the header and layout returned by `encode_arrays`.
+    """
+    return max([len(header)] + [offset + array.nbytes for offset, array in layout])
+
+
+def write_arrays(buffer, header: bytes, layout: list):
+    """
+    Writes a container into a writable buffer (e.g., a `multiprocessing.shared_memory.SharedMemory` buffer).
+    """
+    view = memoryview(buffer).cast('B')
+    view[:len(header)] = header
+    for offset, array in layout:
+        view[offset:offset + array.nbytes] = array.reshape(-1).view(np.uint8)
+
+
+def save_arrays(file, arrays: dict, kind: str, metadata: dict = None):
+    """
+    Saves named arrays into a container file.
+
+    :param file: path of the file
+    :param arrays: dict from name to array
+    :param kind: kind of content, checked when loading
+    :param metadata: JSON-serializable dict stored along with the arrays
+    """
+    header, layout = encode_arrays(arrays, kind, metadata=metadata)
+    with open(file, 'wb') as f:
+        f.write(header)
+        for offset, array in layout:
+            f.seek(offset)
+            f.write(array.reshape(-1).view(np.uint8).data)
+        f.truncate(container_size(header, layout))
+
+
+def read_arrays(buffer, kind: str = None) -> (dict, dict):
+    """
+    Reads the arrays of a container stored in a buffer, without copying them.
+
+    :param buffer: object supporting the buffer protocol with the contents of a container
+    :param kind: if given, the kind of content expected in the container
+    :return: dict from name to (read-only if the buffer is read-only) array, and the metadata dict
+    """
+    view = memoryview(buffer).cast('B')
+    magic, version, length = _HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError('Not an optical-rl-gym array container')
+    if version > VERSION:
+        raise ValueError('Container format version {} is not supported (up to {})'.format(version, VERSION))
+    description = json.loads(bytes(view[_HEADER.size:_HEADER.size + length]).decode('utf-8'))
+    if kind is not None and description['kind'] != kind:
+        raise ValueError('Expected a container of {}, found {}'.format(kind, description['kind']))
+    arrays = {}
+    for spec in description['arrays']:
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape']))
+        if count == 0:
+            arrays[spec['name']] = np.empty(spec['shape'], dtype=dtype)
+            continue
+        arrays[spec['name']] = np.frombuffer(view, dtype=dtype, count=count,
+                                             offset=spec['offset']).reshape(spec['shape'])
+    return arrays, description['metadata']
+
+
+def load_arrays(file, kind: str = None, mmap: bool = True) -> (dict, dict):
+    """
+    Loads the arrays of a container file.
+
+    :param file: path of the file
+    :param kind: if given, the kind of content expected in the file
+    :param mmap: whether the file is memory-mapped (read-only) instead of read into memory
+    :return: dict from name to array, and the metadata dict
+    """
+    if mmap:
+        buffer = np.memmap(file, dtype=np.uint8, mode='r')
+    else:
+        with open(file, 'rb') as f:
+            buffer = bytearray(f.read())
+    return read_arrays(buffer, kind=kind)
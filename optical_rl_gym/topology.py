@@ -0,0 +1,347 @@
+"""
+Builds topologies ready to be used by the environments: the k-shortest paths of every node pair, the modulation
+format of each path, and the node indices.
+The paths of the node pairs are computed in a process pool, and the result is cached in memory (for the
+`KSP_CACHE_SIZE` most recently used topologies) and optionally in a directory, under a hash of the topology and of the
+parameters, so sweeps over the same topology compute them once.
+
+Topologies can also be saved into a compact array file (see `optical_rl_gym.storage`) with `save_topology` and
+memory-mapped with `load_topology`, which creates the `Path` objects of a node pair only when they are first used.
+"""
+import os
+import json
+import hashlib
+import collections
+import collections.abc
+import concurrent.futures
+import numpy as np
+import networkx as nx
+
+from optical_rl_gym.utils import Path, get_k_shortest_paths, get_path_weight, get_path_index, indexed_topology
+from optical_rl_gym.storage import save_arrays, load_arrays, read_arrays
+
+# node pairs below which the paths are computed in the calling process, as the pool would only add overhead
+MIN_PARALLEL_PAIRS = 200
+
+# number of topologies whose paths are kept in memory, the least recently used being evicted first
+KSP_CACHE_SIZE = 8
+
+_ksp_cache = collections.OrderedDict()
+_worker_graph = None
+
+
+def get_modulation_format(length, modulations):
+    for i in range(len(modulations) - 1):
+        if length > modulations[i + 1]['maximum_length'] and length <= modulations[i]['maximum_length']:
+            return modulations[i]
+    return modulations[len(modulations) - 1]
+
+
+def topology_hash(topology, k_paths, weight='length', length='length') -> str:
+    """
+    Returns a hash of the nodes (in order), of the edges with their weights and lengths, and of the parameters of
+    the k-shortest paths computation.
+    """
+    content = {'nodes': [str(node) for node in topology.nodes()],
+               'edges': [[str(n1), str(n2), topology[n1][n2].get(weight), topology[n1][n2].get(length)]
+                         for n1, n2 in topology.edges()],
+               'k_paths': k_paths, 'weight': weight, 'length': length}
+    return hashlib.sha256(json.dumps(content, default=float).encode('utf-8')).hexdigest()
+
+
+def _init_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _pair_paths(pairs, k_paths, weight, graph=None):
+    graph = graph if graph is not None else _worker_graph
+    return [get_k_shortest_paths(graph, n1, n2, k_paths, weight=weight) for n1, n2 in pairs]
+
+
+def compute_k_shortest_paths(topology, k_paths, weight='length', num_workers=None) -> list:
+    """
+    Computes the k-shortest paths of each unordered node pair, in the order of `topology.nodes()`.
+
+    :param topology: the graph
+    :param k_paths: number of paths per node pair
+    :param weight: edge attribute minimized by the paths, or None to count hops
+    :param num_workers: number of processes (default: number of CPUs); 1 computes them in the calling process
+    :return: list of `((n1, n2), [node lists])` tuples
+    """
+    nodes = list(topology.nodes())
+    pairs = [(n1, n2) for idn1, n1 in enumerate(nodes) for n2 in nodes[idn1 + 1:]]
+    num_workers = num_workers if num_workers is not None else os.cpu_count()
+    if num_workers <= 1 or len(pairs) < MIN_PARALLEL_PAIRS:
+        return list(zip(pairs, _pair_paths(pairs, k_paths, weight, graph=topology)))
+    chunk_size = -(-len(pairs) // (4 * num_workers))
+    chunks = [pairs[start:start + chunk_size] for start in range(0, len(pairs), chunk_size)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker,
+                                                initargs=(topology,)) as executor:
+        results = executor.map(_pair_paths, chunks, [k_paths] * len(chunks), [weight] * len(chunks))
+        paths = [pair_paths for chunk_paths in results for pair_paths in chunk_paths]
+    return list(zip(pairs, paths))
+
+
+def _save_ksp(file, topology, ksp, key):
+    node_ids = {node: idx for idx, node in enumerate(topology.nodes())}
+    path_counts = [len(paths) for _, paths in ksp]
+    node_lists = [path for _, paths in ksp for path in paths]
+    save_arrays(file, {'pair_path_counts': np.array(path_counts, dtype=np.int32),
+                       'path_node_counts': np.array([len(path) for path in node_lists], dtype=np.int32),
+                       'path_nodes': np.array([node_ids[node] for path in node_lists for node in path],
+                                              dtype=np.int32)},
+                'ksp', metadata={'hash': key})
+
+
+def _load_ksp(file, topology, key):
+    arrays, metadata = load_arrays(file, kind='ksp', mmap=False)
+    if metadata['hash'] != key:
+        return None
+    nodes = list(topology.nodes())
+    pairs = [(n1, n2) for idn1, n1 in enumerate(nodes) for n2 in nodes[idn1 + 1:]]
+    path_nodes = [nodes[idx] for idx in arrays['path_nodes'].tolist()]
+    node_ends = np.cumsum(arrays['path_node_counts']).tolist()
+    node_lists = [path_nodes[end - count:end] for end, count in zip(node_ends, arrays['path_node_counts'].tolist())]
+    path_ends = np.cumsum(arrays['pair_path_counts']).tolist()
+    return [(pair, node_lists[end - count:end])
+            for pair, end, count in zip(pairs, path_ends, arrays['pair_path_counts'].tolist())]
+
+
+def build_topology(graph, name, k_paths=5, modulations=None, weight='length', length='length', num_workers=None,
+                   cache_dir=None) -> nx.Graph:
+    """
+    Returns a copy of `graph` with everything the environments need: `name`, `ksp`, `k_paths`, `node_indices` and,
+    if given, `modulations`, with the best modulation format of each path according to its length.
+    Path ids follow the order of the node pairs in `graph.nodes()`, as in `examples/create_topology_rmsa.py`.
+
+    :param graph: the graph, with edges having an `index` attribute
+    :param name: name of the topology
+    :param k_paths: number of paths per node pair
+    :param modulations: list of modulation formats, sorted by decreasing maximum length
+    :param weight: edge attribute minimized by the paths, or None to count hops
+    :param length: edge attribute summed to obtain the length of the paths
+    :param num_workers: number of processes used to compute the paths (see `compute_k_shortest_paths`)
+    :param cache_dir: directory where the paths are cached across processes, if given
+    :return: the topology
+    """
+    key = topology_hash(graph, k_paths, weight=weight, length=length)
+    ksp = _ksp_cache.get(key)
+    cache_file = os.path.join(cache_dir, 'ksp-{}.bin'.format(key)) if cache_dir is not None else None
+    if ksp is None and cache_file is not None and os.path.exists(cache_file):
+        ksp = _load_ksp(cache_file, graph, key)
+    if ksp is None:
+        ksp = compute_k_shortest_paths(graph, k_paths, weight=weight, num_workers=num_workers)
+        if cache_file is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            _save_ksp(cache_file, graph, ksp, key)
+    _ksp_cache[key] = ksp
+    _ksp_cache.move_to_end(key)
+    while len(_ksp_cache) > KSP_CACHE_SIZE:
+        _ksp_cache.popitem(last=False)
+
+    topology = graph.copy()
+    k_shortest_paths = {}
+    idp = 0
+    for (n1, n2), paths in ksp:
+        objs = []
+        for path in paths:
+            path_length = get_path_weight(topology, path, weight=length)
+            modulation = get_modulation_format(path_length, modulations) if modulations is not None else None
+            objs.append(Path(idp, path, path_length, best_modulation=modulation))
+            idp += 1
+        k_shortest_paths[n1, n2] = objs
+        k_shortest_paths[n2, n1] = objs
+    topology.graph['name'] = name
+    topology.graph['ksp'] = k_shortest_paths
+    if modulations is not None:
+        topology.graph['modulations'] = modulations
+    topology.graph['k_paths'] = k_paths
+    topology.graph['node_indices'] = []
+    for idx, node in enumerate(topology.nodes()):
+        topology.graph['node_indices'].append(node)
+        topology.nodes[node]['index'] = idx
+    # the paths are indexed here, so environments share them instead of indexing their own copies
+    get_path_index(topology)
+    return topology
+
+
+class LazyKSP(collections.abc.Mapping):
+    """
+    Read-only mapping from node pairs to their k-shortest paths, backed by the arrays of a topology file.
+    The `Path` objects of a node pair (shared by both directions, with their `links` already set) are created on
+    first access.
+    Deep copies return the same object, so environments share the paths instead of duplicating them.
+    """
+
+    def __init__(self, nodes, arrays, modulations=None):
+        self.nodes = nodes
+        self.modulations = modulations
+        self._node_ids = {node: idx for idx, node in enumerate(nodes)}
+        self._arrays = arrays
+        # paths of each unordered node pair, as a contiguous range of rows
+        pair_path_counts = arrays['pair_path_counts'].tolist()
+        pair_ends = np.cumsum(pair_path_counts).tolist()
+        self._pair_rows = {}
+        pair_id = 0
+        for idn1 in range(len(nodes)):
+            for idn2 in range(idn1 + 1, len(nodes)):
+                self._pair_rows[idn1, idn2] = (pair_ends[pair_id] - pair_path_counts[pair_id], pair_ends[pair_id])
+                pair_id += 1
+        self._node_offsets = np.concatenate(([0], np.cumsum(arrays['path_node_counts']))).tolist()
+        self._link_offsets = np.concatenate(([0], np.cumsum(arrays['path_link_counts']))).tolist()
+        self._paths = [None] * len(arrays['path_id'])
+        self._pairs = {}
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __len__(self):
+        return 2 * len(self._pair_rows)
+
+    def __iter__(self):
+        for idn1, idn2 in self._pair_rows:
+            yield self.nodes[idn1], self.nodes[idn2]
+            yield self.nodes[idn2], self.nodes[idn1]
+
+    def __getitem__(self, pair):
+        try:
+            return self._pairs[pair]
+        except KeyError:
+            pass
+        idn1, idn2 = self._node_ids[pair[0]], self._node_ids[pair[1]]
+        start, stop = self._pair_rows[min(idn1, idn2), max(idn1, idn2)]
+        paths = [self.path(row) for row in range(start, stop)]
+        self._pairs[pair] = self._pairs[pair[1], pair[0]] = paths
+        return paths
+
+    def path(self, row: int) -> Path:
+        """
+        Returns the path stored in the given row of the file, creating it on first access.
+        """
+        path = self._paths[row]
+        if path is None:
+            arrays = self._arrays
+            node_list = [self.nodes[idx] for idx in
+                         arrays['path_nodes'][self._node_offsets[row]:self._node_offsets[row + 1]].tolist()]
+            modulation = int(arrays['path_modulation'][row])
+            path = Path(int(arrays['path_id'][row]), node_list, arrays['path_length'][row].item(),
+                        best_modulation=self.modulations[modulation] if modulation >= 0 else None)
+            path.links = np.array(arrays['path_links'][self._link_offsets[row]:self._link_offsets[row + 1]],
+                                  dtype=int)
+            self._paths[row] = path
+        return path
+
+    def get_path_index(self, num_links: int) -> (collections.abc.Sequence, np.ndarray):
+        """
+        Same as `optical_rl_gym.utils.get_path_index`, built from the arrays without creating the paths.
+        """
+        counts = self._arrays['path_link_counts']
+        incidence = np.zeros((len(self._paths), num_links), dtype=bool)
+        incidence[np.repeat(np.arange(len(self._paths)), counts), self._arrays['path_links']] = True
+        return _LazyPaths(self), incidence
+
+
+class _LazyPaths(collections.abc.Sequence):
+    """
+    Paths of a `LazyKSP` sorted by their ids, created on access.
+    """
+
+    def __init__(self, ksp: LazyKSP):
+        self._ksp = ksp
+
+    def __len__(self):
+        return len(self._ksp._paths)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self._ksp.path(idx) for idx in range(len(self))[row]]
+        return self._ksp.path(row)
+
+
+def _modulation_key(modulation) -> str:
+    return json.dumps(modulation, sort_keys=True, default=str)
+
+
+def save_topology(topology, file):
+    """
+    Saves a topology (e.g., built by `build_topology`) into a compact array file: node and edge tables, the path x
+    node and path x link CSR arrays, and the length and modulation format index of each path.
+
+    :param topology: the topology, with node names, modulations and other graph attributes serializable to JSON
+    :param file: path of the file
+    """
+    arrays, metadata = topology_arrays(topology)
+    save_arrays(file, arrays, 'topology', metadata=metadata)
+
+
+def topology_arrays(topology) -> (dict, dict):
+    """
+    Returns the arrays and the metadata stored by `save_topology`, e.g., to write them with
+    `optical_rl_gym.storage.write_arrays` into a shared memory block read by `load_topology`.
+    """
+    topology = indexed_topology(topology)  # the paths of the caller are not modified
+    nodes = list(topology.nodes())
+    node_ids = {node: idx for idx, node in enumerate(nodes)}
+    edges = list(topology.edges())
+    paths, _ = get_path_index(topology)
+    path_rows = {id(path): row for row, path in enumerate(paths)}
+    # rows of the paths of each unordered pair, in the order of the nodes
+    pair_rows = [[path_rows[id(path)] for path in topology.graph['ksp'][n1, n2]]
+                 for idn1, n1 in enumerate(nodes) for n2 in nodes[idn1 + 1:]]
+    assert [row for rows in pair_rows for row in rows] == list(range(len(paths))), \
+        'path ids must follow the order of the node pairs'
+    modulations = topology.graph.get('modulations')
+    # looked up by value, as copied or unpickled paths hold equal but not identical modulation formats
+    modulation_ids = {_modulation_key(modulation): idx for idx, modulation in enumerate(modulations or [])}
+    arrays = {
+        'edge_nodes': np.array([[node_ids[n1], node_ids[n2]] for n1, n2 in edges], dtype=np.int32).reshape((-1, 2)),
+        'edge_index': np.array([topology[n1][n2]['index'] for n1, n2 in edges], dtype=np.int32),
+        'edge_length': np.array([topology[n1][n2].get('length', 0) for n1, n2 in edges]),
+        'edge_weight': np.array([topology[n1][n2].get('weight', 1) for n1, n2 in edges]),
+        'pair_path_counts': np.array([len(rows) for rows in pair_rows], dtype=np.int32),
+        'path_id': np.array([path.path_id for path in paths], dtype=np.int64),
+        'path_length': np.array([path.length for path in paths]),
+        'path_modulation': np.array([modulation_ids[_modulation_key(path.best_modulation)]
+                                     if path.best_modulation is not None else -1 for path in paths], dtype=np.int32),
+        'path_node_counts': np.array([len(path.node_list) for path in paths], dtype=np.int32),
+        'path_nodes': np.array([node_ids[node] for path in paths for node in path.node_list], dtype=np.int32),
+        'path_link_counts': np.array([len(path.links) for path in paths], dtype=np.int32),
+        'path_links': np.concatenate([path.links for path in paths] + [np.zeros(0, dtype=int)]).astype(np.int32),
+    }
+    if all('pos' in topology.nodes[node] for node in nodes):
+        arrays['node_pos'] = np.array([topology.nodes[node]['pos'] for node in nodes], dtype=float)
+    metadata = {'nodes': nodes, 'modulations': modulations,
+                'graph': {key: value for key, value in topology.graph.items()
+                          if key not in ('ksp', 'modulations', 'node_indices')}}
+    return arrays, metadata
+
+
+def load_topology(file, mmap: bool = True) -> nx.Graph:
+    """
+    Loads a topology saved by `save_topology`, ready to be passed to the environments.
+    The arrays are memory-mapped, and the paths are created on demand by a `LazyKSP` in `graph['ksp']`.
+
+    :param file: path of the file, or an object supporting the buffer protocol with its contents
+    :param mmap: whether the file is memory-mapped instead of read into memory
+    :return: the topology
+    """
+    if isinstance(file, (str, os.PathLike)):
+        arrays, metadata = load_arrays(file, kind='topology', mmap=mmap)
+    else:
+        arrays, metadata = read_arrays(file, kind='topology')
+    nodes = metadata['nodes']
+    topology = nx.Graph()
+    topology.graph.update(metadata['graph'])
+    for idx, node in enumerate(nodes):
+        topology.add_node(node, index=idx)
+        if 'node_pos' in arrays:
+            topology.nodes[node]['pos'] = tuple(arrays['node_pos'][idx].tolist())
+    for (n1, n2), index, length, weight in zip(arrays['edge_nodes'].tolist(), arrays['edge_index'].tolist(),
+                                               arrays['edge_length'].tolist(), arrays['edge_weight'].tolist()):
+        topology.add_edge(nodes[n1], nodes[n2], index=index, length=length, weight=weight)
+    if metadata['modulations'] is not None:
+        topology.graph['modulations'] = metadata['modulations']
+    topology.graph['ksp'] = LazyKSP(nodes, arrays, modulations=metadata['modulations'])
+    topology.graph['node_indices'] = list(nodes)
+    return topology
@@ -0,0 +1,190 @@
+import os
+import numpy as np
+
+from optical_rl_gym.storage import save_arrays, load_arrays
+
+
+class TrafficTrace:
+    """
+    Sequence of requests stored column-wise as NumPy arrays.
+    Columns that a type of environment does not use (e.g., `bit_rate` for RWA) can be None.
+    """
+
+    columns = ('arrival_time', 'holding_time', 'source_id', 'destination_id', 'bit_rate', 'service_class')
+
+    def __init__(self, arrival_time, holding_time, source_id, destination_id, bit_rate=None, service_class=None):
+        self.arrival_time = arrival_time
+        self.holding_time = holding_time
+        self.source_id = source_id
+        self.destination_id = destination_id
+        self.bit_rate = bit_rate
+        self.service_class = service_class
+        self.metadata = {}
+        assert all(getattr(self, column) is None or len(getattr(self, column)) == len(arrival_time)
+                   for column in self.columns)
+
+    def __len__(self):
+        return len(self.arrival_time)
+
+    def __getitem__(self, index):
+        """
+        Returns a trace with the requests in the slice `index`.
+        """
+        assert isinstance(index, slice)
+        return TrafficTrace(**{column: None if getattr(self, column) is None else getattr(self, column)[index]
+                               for column in self.columns})
+
+    def rows(self, start, stop):
+        """
+        Returns the requests from `start` to `stop` as a list of tuples of Python scalars, in the order of `columns`.
+        """
+        return list(zip(*[[None] * (min(stop, len(self)) - start) if getattr(self, column) is None
+                          else getattr(self, column)[start:stop].tolist() for column in self.columns]))
+
+    def save(self, file, metadata: dict = None):
+        """
+        Saves the trace into a columnar binary file that can be memory-mapped by `TrafficTrace.load`.
+
+        :param file: path of the file
+        :param metadata: JSON-serializable dict stored along with the trace (e.g., the load and the topology)
+        """
+        save_arrays(file, {column: getattr(self, column) for column in self.columns
+                           if getattr(self, column) is not None}, 'traffic', metadata=metadata)
+
+    @staticmethod
+    def load(file, mmap: bool = True) -> 'TrafficTrace':
+        """
+        Loads a trace saved by `TrafficTrace.save`.
+        With `mmap`, the columns are read-only views of the file, so processes replaying the same file share it.
+
+        :return: the trace, with the metadata stored in the file in its `metadata` attribute
+        """
+        arrays, metadata = load_arrays(file, kind='traffic', mmap=mmap)
+        trace = TrafficTrace(**arrays)
+        trace.metadata = metadata
+        return trace
+
+
+class TrafficRecorder:
+    """
+    Records the requests drawn by an environment.
+    To be used, set it as the `traffic_recorder` attribute of the environment and then call
+    `env.reset(only_counters=False)`, so that the recording starts from the first request of the simulation.
+
+    By default, the requests are kept in memory. If a `file` is given, they are streamed to disk instead: every
+    `buffer_size` requests, the buffered ones are appended to a temporary file per column, and `close` writes the
+    trace into `file` (in the format of `TrafficTrace.save`), so memory stays bounded however long the recording.
+    """
+
+    dtypes = (float, float, int, int, int, int)  # of each column of `TrafficTrace.columns`
+
+    def __init__(self, file=None, buffer_size: int = 4096, metadata: dict = None):
+        """
+        :param file: path of the file where the requests are streamed; if None, they are kept in memory
+        :param buffer_size: number of requests buffered before they are appended to the temporary files
+        :param metadata: JSON-serializable dict stored along with the trace when streaming
+        """
+        assert buffer_size > 0
+        self.file = file
+        self.buffer_size = buffer_size
+        self.metadata = metadata
+        self.requests = []  # all the requests, or the ones not flushed yet when streaming
+        self._num_flushed = 0
+        self._parts = None  # temporary file of each column with values, when streaming
+        self._closed = False
+
+    def append(self, arrival_time, holding_time, source_id, destination_id, bit_rate=None, service_class=None):
+        self.requests.append((arrival_time, holding_time, source_id, destination_id, bit_rate, service_class))
+        if self.file is not None and len(self.requests) >= self.buffer_size:
+            self._flush()
+
+    def __len__(self):
+        return self._num_flushed + len(self.requests)
+
+    def _flush(self):
+        assert not self._closed, 'the recording was closed'
+        if len(self.requests) == 0:
+            return
+        columns = list(zip(*self.requests))
+        if self._parts is None:
+            self._parts = {column: open('{}.{}.part'.format(self.file, column), 'wb')
+                           for column, values in zip(TrafficTrace.columns, columns) if values[0] is not None}
+        for column, values, dtype in zip(TrafficTrace.columns, columns, self.dtypes):
+            if column in self._parts:
+                self._parts[column].write(np.array(values, dtype=np.dtype(dtype).newbyteorder('<')).tobytes())
+        self._num_flushed += len(self.requests)
+        self.requests = []
+
+    def close(self):
+        """
+        Writes the streamed requests into `file` and removes the temporary files.
+        """
+        if self.file is None or self._closed:
+            return
+        self._flush()
+        self._closed = True
+        parts = self._parts or {}
+        for part in parts.values():
+            part.close()
+        dtypes = dict(zip(TrafficTrace.columns, self.dtypes))
+        columns = {column: np.memmap(part.name, dtype=np.dtype(dtypes[column]).newbyteorder('<'), mode='r')
+                   for column, part in parts.items()}
+        if len(columns) == 0:  # nothing was recorded
+            columns = {column: np.zeros(0, dtype=dtypes[column]) for column in TrafficTrace.columns[:4]}
+        save_arrays(self.file, columns, 'traffic', metadata=self.metadata)
+        del columns
+        for part in parts.values():
+            os.remove(part.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def to_trace(self) -> TrafficTrace:
+        """
+        Returns the recorded requests as a trace, which replays them when passed as the `traffic` of an environment.
+        When streaming, the recording is closed and the trace is memory-mapped from `file`.
+        """
+        if self.file is not None:
+            self.close()
+            return TrafficTrace.load(self.file)
+        columns = list(zip(*self.requests)) if len(self.requests) > 0 else [()] * len(TrafficTrace.columns)
+        return TrafficTrace(*[None if len(values) > 0 and values[0] is None else np.array(values, dtype=dtype)
+                              for values, dtype in zip(columns, self.dtypes)])
+
+    def save(self, file, metadata: dict = None):
+        assert self.file is None, 'streamed recordings are written into their file by close'
+        self.to_trace().save(file, metadata=metadata)
+
+
+def generate_traffic(num_requests, mean_service_inter_arrival_time, mean_service_holding_time, node_pair_sampler,
+                     random_state, start_time=0., bit_rate_lower_bound=None, bit_rate_higher_bound=None,
+                     classes_arrival_probabilities=None) -> TrafficTrace:
+    """
+    Generates a trace with `num_requests` requests, drawing each column at once.
+
+    :param num_requests: number of requests to be generated
+    :param mean_service_inter_arrival_time: mean of the exponential inter-arrival times
+    :param mean_service_holding_time: mean of the exponential holding times
+    :param node_pair_sampler: `optical_rl_gym.utils.NodePairSampler` used to draw the source and destination
+    :param random_state: `numpy.random.Generator` used to draw all the values
+    :param start_time: time after which the first request arrives
+    :param bit_rate_lower_bound: lower bound of the uniform bit rate; if None, no bit rate is generated
+    :param bit_rate_higher_bound: higher bound (inclusive) of the uniform bit rate
+    :param classes_arrival_probabilities: probability of each service class; if None, no class is generated
+    :return: the generated trace
+    """
+    arrival_time = start_time + np.cumsum(random_state.exponential(mean_service_inter_arrival_time, num_requests))
+    holding_time = random_state.exponential(mean_service_holding_time, num_requests)
+    source_id, destination_id = node_pair_sampler.sample_ids(random_state.random((num_requests, 2)))
+    bit_rate = None
+    if bit_rate_lower_bound is not None:
+        bit_rate = random_state.integers(bit_rate_lower_bound, bit_rate_higher_bound + 1, num_requests)
+    service_class = None
+    if classes_arrival_probabilities is not None:
+        probabilities = np.asarray(classes_arrival_probabilities, dtype=float)
+        service_class = random_state.choice(len(probabilities), num_requests, p=probabilities / np.sum(probabilities))
+    return TrafficTrace(arrival_time, holding_time, source_id, destination_id,
+                        bit_rate=bit_rate, service_class=service_class)
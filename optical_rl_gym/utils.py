@@ -1,20 +1,42 @@
-from itertools import islice
+import copy
+import time
+import bisect
+import heapq
+import math
+import collections
+from itertools import islice, accumulate, count
 import networkx as nx
 import numpy as np
 
 
 class Path:
 
+    __slots__ = ('path_id', 'node_list', 'length', 'best_modulation', 'hops', 'links')
+
     def __init__(self, path_id, node_list, length, best_modulation=None):
         self.path_id = path_id
         self.node_list = node_list
         self.length = length
         self.best_modulation = best_modulation
         self.hops = len(node_list) - 1
+        self.links = None  # array of link indices, filled by `get_path_index`
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        # topologies pickled before `Path` used slots store the attributes as a dict without `links`
+        self.links = None
+        for name, value in state.items():
+            setattr(self, name, value)
 
 
 class Service:
 
+    __slots__ = ('service_id', 'arrival_time', 'holding_time', 'source', 'source_id', 'destination',
+                 'destination_id', 'bit_rate', 'service_class', 'best_modulation', 'number_slots', 'route',
+                 'initial_slot', 'accepted')
+
     def __init__(self, service_id, source, source_id, destination=None, destination_id=None, arrival_time=None,
                  holding_time=None, bit_rate=None, best_modulation=None, service_class=None, number_slots=None):
         self.service_id = service_id
@@ -39,6 +61,309 @@ class Service:
         return f'Serv. {self.service_id} ({self.source} -> {self.destination})' + msg
 
 
+class ServicePool:
+    """
+    Recycles `Service` objects that are no longer referenced by the environment, avoiding one allocation per request.
+    """
+
+    def __init__(self):
+        self._free = []
+
+    def acquire(self, *args, **kwargs) -> Service:
+        """
+        Returns a service initialized with the given arguments, reusing a released one if available.
+        """
+        if len(self._free) > 0:
+            service = self._free.pop()
+            service.__init__(*args, **kwargs)
+            return service
+        return Service(*args, **kwargs)
+
+    def release(self, service: Service):
+        self._free.append(service)
+
+
+class RunningServices:
+    """
+    Registry of the services currently carried by the network.
+    Services are kept in a dense list (and their ids in the dense `ids` array), with a dict from service id to
+    position, so that adding a service and removing it (moving the last one into its position) take constant time.
+    The registry is a read-only sequence of the running services (in no particular order).
+    Each link keeps a dict from service id to service, and `link_counts` holds the number of services on each link.
+    """
+
+    def __init__(self, num_links: int):
+        self.services = []
+        self._positions = {}
+        self._ids = np.empty(64, dtype=int)
+        self.links = [{} for _ in range(num_links)]
+        self.link_counts = np.zeros(num_links, dtype=int)
+
+    def __len__(self):
+        return len(self.services)
+
+    def __iter__(self):
+        return iter(self.services)
+
+    def __getitem__(self, index):
+        return self.services[index]
+
+    def __contains__(self, service: Service):
+        return service.service_id in self._positions
+
+    @property
+    def ids(self) -> np.ndarray:
+        """
+        Ids of the running services, in the order of `services`.
+        """
+        return self._ids[:len(self.services)]
+
+    def get(self, service_id: int) -> Service:
+        return self.services[self._positions[service_id]]
+
+    def add(self, service: Service, links):
+        """
+        Registers a service running over the given link indices.
+        """
+        position = len(self.services)
+        if position == len(self._ids):
+            self._ids = np.concatenate((self._ids, np.empty(position, dtype=int)))
+        self._positions[service.service_id] = position
+        self.services.append(service)
+        self._ids[position] = service.service_id
+        for link in links:
+            self.links[link][service.service_id] = service
+        self.link_counts[links] += 1
+
+    def remove(self, service: Service):
+        """
+        Unregisters a running service from the registry and from each link of its route.
+        Raises `KeyError` if the service is not running.
+        """
+        position = self._positions.pop(service.service_id)
+        last = self.services.pop()
+        if position < len(self.services):
+            self.services[position] = last
+            self._positions[last.service_id] = position
+            self._ids[position] = last.service_id
+        for link in service.route.links:
+            del self.links[link][service.service_id]
+        self.link_counts[service.route.links] -= 1
+
+
+class LinkRunningServices:
+    """
+    Read-only view of the services running on a link (one of the `links` dicts of a `RunningServices` registry),
+    which behaves as the list of services (or, with `ids`, of service ids) that the environments used to keep in the
+    `running_services` of each link.
+    """
+
+    def __init__(self, services: dict, ids: bool = False):
+        self._services = services
+        self._ids = ids
+
+    def __len__(self):
+        return len(self._services)
+
+    def __iter__(self):
+        return iter(self._services.keys() if self._ids else self._services.values())
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def __contains__(self, item):
+        if self._ids:
+            return item in self._services
+        return self._services.get(getattr(item, 'service_id', None)) is item
+
+
+class RunningServiceIds:
+    """
+    Read-only view of the ids of the services of a `RunningServices` registry, which behaves as the list of ids that
+    the RWA and QoS environments used to keep in `topology.graph['running_services']`.
+    """
+
+    def __init__(self, running_services: RunningServices):
+        self._running_services = running_services
+
+    def __len__(self):
+        return len(self._running_services)
+
+    def __iter__(self):
+        return iter(self._running_services.ids.tolist())
+
+    def __getitem__(self, index):
+        return self._running_services.ids.tolist()[index]
+
+    def __contains__(self, service_id: int):
+        return service_id in self._running_services._positions
+
+
+class EventQueue:
+    """
+    Priority queue of timed events, e.g., the releases of the services.
+    Entries are `(time, sequence, item)` tuples in a binary heap, where the increasing integer `sequence` breaks
+    ties in insertion order, so items themselves are never compared.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._sequence = count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, time: float, item):
+        heapq.heappush(self._heap, (time, next(self._sequence), item))
+
+    def peek_time(self) -> float:
+        """
+        Returns the time of the next event without removing it, or infinity if the queue is empty.
+        """
+        return self._heap[0][0] if len(self._heap) > 0 else math.inf
+
+    def pop(self) -> (float, object):
+        time, _, item = heapq.heappop(self._heap)
+        return time, item
+
+    def pop_until(self, time: float) -> list:
+        """
+        Removes and returns, in time order, the items of all the events happening up to (and including) `time`.
+        """
+        heap = self._heap
+        items = []
+        while len(heap) > 0 and heap[0][0] <= time:
+            items.append(heapq.heappop(heap)[2])
+        return items
+
+    def pop_ids_until(self, time: float) -> np.ndarray:
+        """
+        Same as `pop_until` for events whose items are integer ids (e.g., of services), returned as an array.
+        """
+        return np.array(self.pop_until(time), dtype=int)
+
+    def items(self) -> list:
+        """
+        Returns the items of the pending events, in no particular order.
+        """
+        return [entry[2] for entry in self._heap]
+
+    def clear(self):
+        self._heap = []
+
+
+class NodePairSampler:
+    """
+    Draws source-destination pairs according to the node request probabilities.
+    The cumulative distributions of the source and of the destination given each source are computed once, so each
+    draw takes one binary search per node. Draws consume the random number generator exactly as
+    `random.Random.choices` would with the same weights, keeping seeded simulations reproducible.
+    """
+
+    def __init__(self, nodes, node_ids, node_request_probabilities):
+        """
+        :param nodes: list of nodes in the order of `node_request_probabilities`
+        :param node_ids: list with the index of each node, as used to renormalize the destination probabilities
+        :param node_request_probabilities: probability of each node being the source or destination of a request
+        """
+        self.nodes = list(nodes)
+        self.node_ids = np.array(node_ids, dtype=int)
+        self.source_cdf = list(accumulate(node_request_probabilities))
+        self.destination_cdfs = {}
+        for src_id in node_ids:
+            new_node_probabilities = np.copy(node_request_probabilities)
+            new_node_probabilities[src_id] = 0.
+            new_node_probabilities = new_node_probabilities / np.sum(new_node_probabilities)
+            self.destination_cdfs[src_id] = list(accumulate(new_node_probabilities))
+
+    def sample(self, rng):
+        """
+        Draws one pair using a `random.Random` generator.
+
+        :return: source node, source node id, destination node, destination node id
+        """
+        cdf = self.source_cdf
+        src_idx = bisect.bisect(cdf, rng.random() * (cdf[-1] + 0.0), 0, len(cdf) - 1)
+        src_id = int(self.node_ids[src_idx])
+        cdf = self.destination_cdfs[src_id]
+        dst_idx = bisect.bisect(cdf, rng.random() * (cdf[-1] + 0.0), 0, len(cdf) - 1)
+        return self.nodes[src_idx], src_id, self.nodes[dst_idx], int(self.node_ids[dst_idx])
+
+    def sample_ids(self, uniforms):
+        """
+        Draws pairs in bulk from uniform random numbers in [0, 1).
+        Row `i` of `uniforms` gives the same pair as `sample` would when its generator returns `uniforms[i, 0]`
+        and `uniforms[i, 1]`.
+
+        :param uniforms: array with shape (K, 2)
+        :return: arrays with the K source node ids and the K destination node ids
+        """
+        uniforms = np.asarray(uniforms)
+        src_idx = np.minimum(np.searchsorted(self.source_cdf, uniforms[:, 0] * (self.source_cdf[-1] + 0.0),
+                                             side='right'), len(self.nodes) - 1)
+        src_ids = self.node_ids[src_idx]
+        dst_idx = np.zeros(len(uniforms), dtype=int)
+        for src_id in np.unique(src_ids):
+            requests = src_ids == src_id
+            cdf = self.destination_cdfs[src_id]
+            dst_idx[requests] = np.searchsorted(cdf, uniforms[requests, 1] * (cdf[-1] + 0.0), side='right')
+        return src_ids, self.node_ids[np.minimum(dst_idx, len(self.nodes) - 1)]
+
+
+class PhaseProfiler:
+    """
+    Accumulates the wall time and the number of calls of the phases of an environment (see
+    `OpticalNetworkEnv.enable_profiling`).
+    Times are exclusive: the time of a phase called within another one (e.g., the release of services within the
+    request generation) is only counted in the inner phase.
+    """
+
+    def __init__(self):
+        self.times = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self._nested = []  # time spent in the phases called within each of the active phases
+
+    def wrap(self, phase: str, function, nested_only: bool = False):
+        """
+        Returns a function that calls `function` and accumulates its time in `phase`.
+
+        :param phase: name of the phase
+        :param function: function to be profiled
+        :param nested_only: if True, only the calls made within another profiled phase are accounted (e.g., to leave
+            out the calls made by the heuristics between steps)
+        """
+        def profiled(*args, **kwargs):
+            if nested_only and len(self._nested) == 0:
+                return function(*args, **kwargs)
+            self._nested.append(0.)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.times[phase] += elapsed - self._nested.pop()
+                self.calls[phase] += 1
+                if len(self._nested) > 0:
+                    self._nested[-1] += elapsed
+        profiled.__wrapped__ = function
+        return profiled
+
+    def reset(self):
+        self.times.clear()
+        self.calls.clear()
+
+    def summary(self) -> dict:
+        """
+        :return: dict from each phase to its total time (s), number of calls, mean time per call (us) and fraction of
+            the time of all phases
+        """
+        total = sum(self.times.values())
+        return {phase: {'time': elapsed, 'calls': self.calls[phase],
+                        'mean_us': elapsed / self.calls[phase] * 1e6 if self.calls[phase] > 0 else 0.,
+                        'fraction': elapsed / total if total > 0 else 0.}
+                for phase, elapsed in self.times.items()}
+
+
 def start_environment(env, steps):
     done = True
     for i in range(steps):
@@ -61,6 +386,55 @@ def get_path_weight(graph, path, weight='length'):
     return np.sum([graph[path[i]][path[i + 1]][weight] for i in range(len(path) - 1)])
 
 
+def get_path_index(topology):
+    """
+    Builds the integer index of the paths in `topology.graph['ksp']`.
+    Each path that does not have it yet receives a `links` attribute with the array of the indices of the links it
+    traverses, so the paths of a topology owned by someone else are indexed on a copy (see `indexed_topology`).
+
+    :param topology: topology graph with the k-shortest paths computed
+    :return: list with the paths sorted by their ids, and the path x link incidence matrix with rows in the same order
+    """
+    if hasattr(topology.graph['ksp'], 'get_path_index'):  # paths loaded by `optical_rl_gym.topology.load_topology`
+        return topology.graph['ksp'].get_path_index(topology.number_of_edges())
+    paths = {}
+    for path_list in topology.graph['ksp'].values():
+        for path in path_list:
+            paths[id(path)] = path
+    paths = sorted(paths.values(), key=lambda p: p.path_id)
+    incidence = np.zeros((len(paths), topology.number_of_edges()), dtype=bool)
+    for row, path in enumerate(paths):
+        if getattr(path, 'links', None) is None:
+            path.links = np.array([topology[path.node_list[i]][path.node_list[i + 1]]['index']
+                                   for i in range(len(path.node_list) - 1)], dtype=int)
+        incidence[row, path.links] = True
+    return paths, incidence
+
+
+def is_indexed(topology) -> bool:
+    """
+    Returns whether all the paths of `topology` already have their `links` attribute (e.g., topologies built by
+    `optical_rl_gym.topology.build_topology` or loaded by `optical_rl_gym.topology.load_topology`).
+    """
+    ksp = topology.graph['ksp']
+    return hasattr(ksp, 'get_path_index') or \
+        all(getattr(path, 'links', None) is not None for path_list in ksp.values() for path in path_list)
+
+
+def indexed_topology(topology):
+    """
+    Returns a shallow copy of `topology` (with its own graph, node and link attribute dicts) whose paths have their
+    `links` attribute. The paths are shared with `topology` if they are already indexed, and deep-copied otherwise,
+    so `topology` and its paths are never modified. Environments created from the result share its paths, so a pickled
+    topology should be indexed once with this function before creating many environments from it.
+    """
+    copied = topology.copy()
+    if not is_indexed(topology):
+        copied.graph['ksp'] = copy.deepcopy(topology.graph['ksp'])
+        get_path_index(copied)
+    return copied
+
+
 def random_policy(env):
     return env.action_space.sample()
 
@@ -0,0 +1,261 @@
+"""
+Runs environments in worker processes that exchange actions, observations, rewards, dones, action masks and info
+values through `multiprocessing.shared_memory` buffers instead of pickling them through pipes.
+
+The main process and the workers synchronize with a `multiprocessing.Barrier`: the main process writes the command
+and the actions and waits on the barrier to start the workers, and waits on it again for them to finish.
+The topology is written once into a read-only shared memory block in the format of
+`optical_rl_gym.topology.save_topology`, and each worker loads it with `load_topology`, so the node tables and the
+k-shortest paths are not copied into every worker.
+"""
+import gc
+import queue
+import threading
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import gym
+import numpy as np
+
+from optical_rl_gym.storage import encode_arrays, container_size, write_arrays
+from optical_rl_gym.topology import topology_arrays, load_topology
+
+_STEP, _RESET, _CLOSE = 0, 1, 2
+
+DEFAULT_INFO_KEYS = ('service_blocking_rate', 'episode_service_blocking_rate',
+                     'bit_rate_blocking_rate', 'episode_bit_rate_blocking_rate')
+
+
+def _attach(specs):
+    """
+    Attaches to the shared memory blocks described by `specs` (name -> (block name, shape, dtype)).
+    """
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return blocks, arrays
+
+
+def _worker(index, env_id, env_kwargs, wrapper, seed, topology_block, specs, info_keys, barrier, errors):
+    blocks, arrays = [], {}
+    env = None
+    try:
+        topology_memory = shared_memory.SharedMemory(name=topology_block)
+        blocks.append(topology_memory)
+        topology = load_topology(topology_memory.buf)
+        env = gym.make(env_id, topology=topology, seed=seed, **env_kwargs)
+        if wrapper is not None:
+            env = wrapper(env)
+        attached, arrays = _attach(specs)
+        blocks.extend(attached)
+        command = arrays['command']
+        while True:
+            barrier.wait()
+            if command[0] == _CLOSE:
+                break
+            if command[0] == _RESET:
+                observation = env.reset()
+            else:
+                observation, reward, done, info = env.step(arrays['actions'][index].tolist())
+                arrays['rewards'][index] = reward
+                arrays['dones'][index] = done
+                arrays['infos'][index] = [info.get(key, np.nan) for key in info_keys]
+                if done:
+                    observation = env.reset()
+            arrays['observations'][index] = observation
+            if 'masks' in arrays:
+                arrays['masks'][index] = env.action_masks()
+            barrier.wait()
+    except threading.BrokenBarrierError:
+        pass  # the main process gave up waiting, or another worker failed
+    except Exception:
+        errors.put((index, traceback.format_exc()))
+        barrier.abort()
+    finally:
+        if env is not None:
+            env.close()
+        # the arrays, the environment and the topology hold views of the blocks, which are released before closing them
+        arrays = command = env = topology = None
+        gc.collect()
+        for block in blocks:
+            block.close()
+
+
+class SharedMemoryVectorEnv:
+    """
+    Runs `num_envs` copies of a registered environment in worker processes.
+    Environment `i` is created with `seed + i`, and is reset (with the default `only_counters=True`) when its
+    episode finishes, so the observation returned along with `done` is the first one of the next episode.
+
+    The environments must have `Box` observations (e.g., `DeepRMSA-v0`, or `RMSA-v0` with the
+    `SimpleMatrixObservation` wrapper). The numeric values of `info_keys` in the info of each step are returned in the
+    infos (NaN if the environment does not report them).
+    """
+
+    def __init__(self, env_id, num_envs, topology, env_kwargs=None, wrapper=None, seed=None, action_masks=True,
+                 info_keys=DEFAULT_INFO_KEYS, context=None, timeout=60.):
+        """
+        :param env_id: id of the registered environment, e.g., 'DeepRMSA-v0'
+        :param num_envs: number of environments (and of worker processes)
+        :param topology: topology passed to the environments, which must be supported by `save_topology`
+        :param env_kwargs: other keyword arguments of the environments
+        :param wrapper: picklable callable applied to each environment, e.g., `SimpleMatrixObservation`
+        :param seed: seed of the first environment
+        :param action_masks: whether the action masks of the environments are kept in shared memory
+        :param info_keys: keys of the info values returned by `step`
+        :param context: `multiprocessing` context or start method; defaults to the platform default
+        :param timeout: seconds to wait for the workers to finish each reset or step before failing, or None to wait
+            indefinitely
+        """
+        self.num_envs = num_envs
+        self.timeout = timeout
+        self.info_keys = tuple(info_keys)
+        env_kwargs = dict(env_kwargs or {})
+        self._blocks = []
+        self._processes = []
+        self._barrier = None
+        self._closed = False
+
+        arrays, metadata = topology_arrays(topology)
+        header, layout = encode_arrays(arrays, 'topology', metadata=metadata)
+        self._topology_block = self._create_block(container_size(header, layout))
+        write_arrays(self._topology_block.buf, header, layout)
+
+        # a local environment describes the spaces and the shape of the masks
+        env = gym.make(env_id, topology=topology, seed=seed, **env_kwargs)
+        if wrapper is not None:
+            env = wrapper(env)
+        self.observation_space = env.observation_space
+        self.action_space = env.action_space
+        assert isinstance(self.observation_space, gym.spaces.Box), 'observations must be of a Box space'
+        # the dtype of the observations is taken from an actual one, as some environments return floats in uint8 spaces
+        observation = np.asarray(env.reset())
+        specs = {
+            'command': ((1,), np.int64),
+            'actions': ((num_envs,) + self.action_space.shape, np.int64),
+            'observations': ((num_envs,) + observation.shape, observation.dtype),
+            'rewards': ((num_envs,), np.float64),
+            'dones': ((num_envs,), np.bool_),
+            'infos': ((num_envs, len(self.info_keys)), np.float64),
+        }
+        if action_masks:
+            specs['masks'] = ((num_envs,) + np.shape(env.action_masks()), np.bool_)
+        env.close()
+
+        self._arrays = {}
+        block_specs = {}
+        for name, (shape, dtype) in specs.items():
+            block = self._create_block(max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+            self._arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            block_specs[name] = (block.name, shape, dtype)
+
+        if context is None or isinstance(context, str):
+            context = mp.get_context(context)
+        self._barrier = context.Barrier(num_envs + 1)
+        self._errors = context.Queue()
+        for index in range(num_envs):
+            process = context.Process(target=_worker, daemon=True,
+                                      args=(index, env_id, env_kwargs, wrapper, None if seed is None else seed + index,
+                                            self._topology_block.name, block_specs, self.info_keys, self._barrier,
+                                            self._errors))
+            process.start()
+            self._processes.append(process)
+
+    def _create_block(self, size):
+        block = shared_memory.SharedMemory(create=True, size=size)
+        self._blocks.append(block)
+        return block
+
+    def _run(self, command):
+        assert not self._closed, 'the environments are closed'
+        self._arrays['command'][0] = command
+        message = self._exited_worker()
+        if message is None:
+            try:
+                self._barrier.wait(timeout=self.timeout)
+                self._barrier.wait(timeout=self.timeout)
+                return
+            except threading.BrokenBarrierError:
+                message = self._failure()
+        self.close()
+        raise RuntimeError(message)
+
+    def _exited_worker(self) -> str:
+        """
+        Describes the first worker process that has exited, or returns None if all of them are running.
+        """
+        for index, process in enumerate(self._processes):
+            if not process.is_alive():
+                return 'environment {} exited unexpectedly with exit code {}'.format(index, process.exitcode)
+        return None
+
+    def _failure(self) -> str:
+        """
+        Describes why the barrier was broken: an exception in a worker, a worker that exited, or a timeout.
+        """
+        try:
+            index, error = self._errors.get(timeout=1)
+            return 'environment {} failed:\n{}'.format(index, error)
+        except queue.Empty:
+            pass
+        message = self._exited_worker()
+        if message is not None:
+            return message
+        return 'the environments did not finish within the timeout of {} s'.format(self.timeout)
+
+    def reset(self) -> np.ndarray:
+        """
+        Resets all the environments.
+
+        :return: the observations, a view of the shared buffer that is overwritten by the next call
+        """
+        self._run(_RESET)
+        return self._arrays['observations']
+
+    def step(self, actions):
+        """
+        Steps all the environments.
+
+        :param actions: action of each environment
+        :return: the observations, rewards and dones, as views of the shared buffers that are overwritten by the next
+            call, and the list of infos
+        """
+        self._arrays['actions'][:] = actions
+        self._run(_STEP)
+        infos = [dict(zip(self.info_keys, values)) for values in self._arrays['infos'].tolist()]
+        return self._arrays['observations'], self._arrays['rewards'], self._arrays['dones'], infos
+
+    def action_masks(self) -> np.ndarray:
+        """
+        Returns the action masks of the current requests, as `env.action_masks()` of each environment.
+        """
+        return self._arrays['masks']
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        # at interpreter exit, the workers may have been terminated by `multiprocessing` before this is called
+        if self._barrier is not None and not self._barrier.broken and \
+                all(process.is_alive() for process in self._processes):
+            self._arrays['command'][0] = _CLOSE
+            try:
+                self._barrier.wait(timeout=60)
+            except threading.BrokenBarrierError:
+                pass
+        for process in self._processes:
+            # after a failure, the workers may be blocked on the broken barrier or in the environment
+            process.join(timeout=1 if self._barrier is not None and self._barrier.broken else 60)
+            if process.is_alive():
+                process.terminate()
+        self._arrays = {}
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __del__(self):
+        if not getattr(self, '_closed', True):
+            self.close()
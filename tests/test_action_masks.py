@@ -0,0 +1,68 @@
+from optical_rl_gym.envs.rmsa_env import RMSAEnv
+from optical_rl_gym.envs.deeprmsa_env import DeepRMSAEnv
+from optical_rl_gym.envs.rwa_env import RWAEnv
+from optical_rl_gym.envs.qos_constrained_ra import QoSConstrainedRA
+
+import pickle
+import random
+import numpy as np
+
+seed = 10
+rng = random.Random(seed)
+
+with open(f'../examples/topologies/nsfnet_chen_eon_5-paths.h5', 'rb') as f:
+    topology = pickle.load(f)
+
+# the mask of RMSAEnv matches checking every path and initial slot, and sampling from it never blocks a request
+for backend in ['array', 'bitset']:
+    env = RMSAEnv(topology=topology, seed=seed, load=400, mean_service_holding_time=25, num_spectrum_resources=32,
+                  allow_rejection=True, spectrum_backend=backend)
+    for _ in range(500):
+        mask = env.joint_action_masks()
+        expected = np.zeros_like(mask)
+        for idp, path in enumerate(env.k_shortest_paths[env.service.source, env.service.destination]):
+            for initial_slot in range(env.num_spectrum_resources):
+                expected[idp, initial_slot] = env.is_path_free(path, initial_slot, env.get_number_slots(path))
+        expected[env.k_paths, env.num_spectrum_resources] = True
+        assert np.array_equal(mask, expected)
+        # the flat MultiDiscrete mask marks the paths and the initial slots that are part of some valid action
+        assert np.array_equal(env.action_masks(), np.concatenate((expected.any(axis=1), expected.any(axis=0))))
+        valid = np.argwhere(mask)
+        env.step(valid[rng.randrange(len(valid))])
+    print('RMSA', backend, 'accepted:', env.services_accepted)
+
+env = DeepRMSAEnv(topology=topology, seed=seed, mean_service_inter_arrival_time=0.02, num_spectrum_resources=32,
+                  allow_rejection=True)
+for _ in range(500):
+    valid = np.flatnonzero(env.action_masks())
+    action = valid[rng.randrange(len(valid))]
+    _, reward, _, _ = env.step(action)
+    assert action == env.k_paths * env.j or reward == 1
+print('DeepRMSA accepted:', env.services_accepted)
+
+env = RWAEnv(topology=topology, seed=seed, load=600, num_spectrum_resources=16)
+for _ in range(500):
+    valid = np.flatnonzero(env.action_masks())
+    action = valid[rng.randrange(len(valid))]
+    _, reward, _, _ = env.step(action)
+    assert action == env.k_paths or reward == 1
+print('RWA accepted:', env.services_accepted)
+
+with open(f'../examples/topologies/nsfnet_chen_5-paths.h5', 'rb') as f:
+    topology = pickle.load(f)
+
+# the mask of QoSConstrainedRA matches checking every path allowed to the class of the service, and sampling from
+# it never blocks a request
+env = QoSConstrainedRA(topology=topology, seed=seed, load=600, num_spectrum_resources=16, num_service_classes=2,
+                       classes_arrival_probabilities=[.5, .5], classes_reward=[10., 1.])
+for _ in range(500):
+    mask = env.action_masks()
+    paths = env.k_shortest_paths[env.service.source, env.service.destination]
+    expected = [env._is_path_free(path, env.service.number_slots) and (env.service.service_class != 0 or idp == 0)
+                for idp, path in enumerate(paths)] + [False] * (env.k_paths - len(paths)) + [True]
+    assert mask.tolist() == expected
+    valid = np.flatnonzero(mask)
+    action = valid[rng.randrange(len(valid))]
+    _, reward, _, _ = env.step(action)
+    assert action == env.k_paths or reward > 0
+print('QoS accepted:', env.services_accepted)
@@ -0,0 +1,62 @@
+import gym
+from optical_rl_gym.envs.batched_rmsa_env import BatchedRMSAEnv
+from optical_rl_gym.envs.batched_rmsa_env import shortest_path_first_fit as batched_shortest_path_first_fit
+from optical_rl_gym.envs.rmsa_env import shortest_path_first_fit
+
+import time
+import pickle
+import logging
+import numpy as np
+
+load = 50
+logging.getLogger('rmsaenv').setLevel(logging.INFO)
+
+seed = 10
+num_envs = 4
+episode_length = 1000
+
+with open(f'../examples/topologies/nsfnet_chen_eon_5-paths.h5', 'rb') as f:
+    topology = pickle.load(f)
+
+env_args = dict(topology=topology, allow_rejection=True, load=load, mean_service_holding_time=25,
+                episode_length=episode_length, num_spectrum_resources=64)
+
+batched_env = BatchedRMSAEnv(num_envs=num_envs, seed=seed, **env_args)
+envs = [gym.make('RMSA-v0', seed=seed + i, **env_args) for i in range(num_envs)]
+
+batched_rewards = np.zeros(num_envs)
+start = time.time()
+done = np.zeros(num_envs, dtype=bool)
+while not np.all(done):
+    _, rewards, done, _ = batched_env.step(batched_shortest_path_first_fit(batched_env))
+    batched_rewards += rewards
+print('Batched SP-FF:', batched_rewards, f'{num_envs * episode_length / (time.time() - start):.1f} steps/s')
+
+rewards = np.zeros(num_envs)
+start = time.time()
+for i, env in enumerate(envs):
+    done = False
+    while not done:
+        _, reward, done, _ = env.step(shortest_path_first_fit(env))
+        rewards[i] += reward
+print('SP-FF:        ', rewards, f'{num_envs * episode_length / (time.time() - start):.1f} steps/s')
+
+# each simulation of the batched environment reproduces the RMSAEnv with the same seed
+assert np.all(batched_rewards == rewards)
+
+# reassigning the node request probabilities rebuilds the node pair sampler
+probabilities = np.zeros(topology.number_of_nodes())
+probabilities[[0, 1]] = .5
+batched_env.node_request_probabilities = probabilities
+for _ in range(10):
+    batched_env.step(batched_shortest_path_first_fit(batched_env))
+    assert set(batched_env.source_id.tolist()) | set(batched_env.destination_id.tolist()) <= {0, 1}
+
+# drawing node pairs in bulk gives the same pairs as drawing them one at a time
+probabilities = np.arange(1, topology.number_of_nodes() + 1) / np.sum(np.arange(1, topology.number_of_nodes() + 1))
+bulk_env, single_env = [gym.make('RMSA-v0', seed=seed, node_request_probabilities=probabilities, **env_args).unwrapped
+                        for _ in range(2)]
+source_ids, destination_ids = bulk_env.get_node_pairs(500)
+pairs = [single_env._get_node_pair() for _ in range(500)]
+assert source_ids.tolist() == [pair[1] for pair in pairs] and destination_ids.tolist() == [pair[3] for pair in pairs]
+assert np.all(source_ids != destination_ids)
@@ -0,0 +1,77 @@
+from optical_rl_gym.evaluation import evaluate_heuristics, load_sweep
+from optical_rl_gym.envs.rmsa_env import shortest_path_first_fit, shortest_available_path_first_fit
+from optical_rl_gym.utils import evaluate_heuristic
+
+import gym
+
+import time
+import pickle
+import numpy as np
+
+
+
+def first_block(env):
+    return 0
+
+
+class FirstBlockAgent:
+    """
+    Stands for a trained agent: always chooses the first block of the shortest path from the observation.
+    """
+
+    def predict(self, observation, deterministic=False):
+        assert deterministic and observation.ndim == 1
+        return 0, None
+
+
+if __name__ == '__main__':
+    with open(f'../examples/topologies/nsfnet_chen_eon_5-paths.h5', 'rb') as f:
+        topology = pickle.load(f)
+
+    env_args = dict(mean_service_holding_time=25, episode_length=200, num_spectrum_resources=64)
+    heuristics = [shortest_path_first_fit, shortest_available_path_first_fit]
+
+    start = time.time()
+    serial = evaluate_heuristics('RMSA-v0', heuristics, topology, env_kwargs=dict(load=250, **env_args),
+                                 n_eval_episodes=4, seed=10, num_workers=1)
+    print(f'serial in {time.time() - start:.2f}s')
+    start = time.time()
+    parallel = evaluate_heuristics('RMSA-v0', heuristics, topology, env_kwargs=dict(load=250, **env_args),
+                                   n_eval_episodes=4, seed=10, num_workers=2)
+    print(f'parallel in {time.time() - start:.2f}s')
+
+    print('rewards:', serial['rewards'].tolist())
+    print('blocking:', serial['episode_service_blocking_rate'].tolist())
+    # results do not depend on the number of workers
+    for key in serial:
+        assert np.array_equal(serial[key], parallel[key]), key
+    assert np.all(serial['lengths'] == 200)
+
+    sweep = load_sweep('RMSA-v0', heuristics, topology, [150, 250], env_kwargs=env_args, n_eval_episodes=4, seed=10,
+                       num_workers=2)
+    print('blocking vs load:', sweep['mean']['episode_service_blocking_rate'].tolist())
+    # same episodes as the evaluation at the same load
+    assert np.array_equal(sweep['rewards'][:, 1], serial['rewards'])
+    assert np.all(sweep['half_width']['episode_service_blocking_rate'] > 0)
+
+    # each episode is the second one of the sequential evaluation of an environment with its seed, after a warm-up
+    # of one episode, or the first one without warm-up
+    cold = evaluate_heuristics('RMSA-v0', heuristics, topology, env_kwargs=dict(load=250, **env_args),
+                               n_eval_episodes=4, seed=10, num_workers=2, warmup_requests=0)
+    for idh, heuristic in enumerate(heuristics):
+        for ide, episode_seed in enumerate(serial['seeds'].tolist()):
+            env = gym.make('RMSA-v0', topology=topology, seed=episode_seed, load=250, **env_args)
+            rewards, _ = evaluate_heuristic(env, heuristic, n_eval_episodes=2, return_episode_rewards=True)
+            assert rewards == [cold['rewards'][idh, ide], serial['rewards'][idh, ide]]
+            assert env.unwrapped.episode_services_processed == 200
+            blocking = 1 - env.unwrapped.episode_services_accepted / env.unwrapped.episode_services_processed
+            assert np.isclose(blocking, serial['episode_service_blocking_rate'][idh, ide])
+    print('blocking without warm-up:', cold['episode_service_blocking_rate'].mean(axis=1).tolist(),
+          'with warm-up:', serial['episode_service_blocking_rate'].mean(axis=1).tolist())
+
+    # agents are evaluated from their observations, through `predict`
+    sweep = load_sweep('DeepRMSA-v0', [first_block, FirstBlockAgent()], topology, [.25, .1], env_kwargs=env_args,
+                       load_argument='mean_service_inter_arrival_time', n_eval_episodes=2, seed=10, num_workers=2)
+    assert sweep['heuristics'] == ['first_block', 'FirstBlockAgent']
+    assert np.array_equal(sweep['rewards'][0], sweep['rewards'][1])
+    print('agent rewards:', sweep['rewards'][1].tolist())
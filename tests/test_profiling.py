@@ -0,0 +1,33 @@
+import gym
+from optical_rl_gym.envs.rmsa_env import shortest_available_path_first_fit
+
+import pickle
+
+with open(f'../examples/topologies/nsfnet_chen_eon_5-paths.h5', 'rb') as f:
+    topology = pickle.load(f)
+
+env_args = dict(topology=topology, seed=10, load=250, mean_service_holding_time=25, episode_length=500,
+                num_spectrum_resources=64)
+
+rewards = []
+for profiling in (False, True):
+    env = gym.make('RMSA-v0', **env_args)
+    if profiling:
+        profiler = env.enable_profiling(info_interval=env_args['episode_length'])
+    episode_reward, done = 0, False
+    while not done:
+        _, reward, done, info = env.step(shortest_available_path_first_fit(env))
+        episode_reward += reward
+    rewards.append(episode_reward)
+
+print('rewards:', rewards)
+# profiling does not change the simulation
+assert rewards[0] == rewards[1]
+for phase, values in sorted(info['profile'].items(), key=lambda item: -item[1]['time']):
+    print(f"{phase:<20} {values['calls']:>6} calls {values['mean_us']:>8.1f} us/call {values['fraction']:>6.1%}")
+assert {'request_generation', 'release', 'feasibility', 'provisioning', 'statistics', 'observation'} <= \
+    set(info['profile'])
+assert info['profile']['provisioning']['calls'] == profiler.calls['provisioning']
+
+env.disable_profiling()
+pickle.dumps(env)
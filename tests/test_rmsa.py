@@ -1,7 +1,7 @@
 import gym
 from optical_rl_gym.envs.rmsa_env import shortest_path_first_fit, shortest_available_path_first_fit, \
     least_loaded_path_first_fit, SimpleMatrixObservation
-from optical_rl_gym.utils import evaluate_heuristic, random_policy
+from optical_rl_gym.utils import Service, evaluate_heuristic, random_policy
 
 import pickle
 import logging
@@ -54,3 +54,11 @@ mean_reward_llp, std_reward_llp = evaluate_heuristic(env_llp, least_loaded_path_
 print('LLP-FF:'.ljust(8), f'{mean_reward_llp:.4f}  {std_reward_llp:.4f}')
 print('Bit rate blocking:', (env_llp.episode_bit_rate_requested - env_llp.episode_bit_rate_provisioned) / env_llp.episode_bit_rate_requested)
 print('Request blocking:', (env_llp.episode_services_processed - env_llp.episode_services_accepted) / env_llp.episode_services_processed)
+
+# the running services of the graph and of each link are sequences of services
+running_services = env_llp.topology.graph['running_services']
+assert len(running_services) > 0 and all(isinstance(service, Service) for service in running_services)
+assert running_services[0] in running_services
+for n1, n2 in env_llp.topology.edges():
+    assert all(service in running_services and env_llp.topology[n1][n2]['index'] in service.route.links
+               for service in env_llp.topology[n1][n2]['running_services'])
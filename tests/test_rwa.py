@@ -43,3 +43,10 @@ print('SAP:', mean_reward_sap, std_reward_sap, env_sap.actions_output)
 env_llp = gym.make('RWA-v0', **env_args)
 mean_reward_llp, std_reward_llp = evaluate_heuristic(env_llp, least_loaded_path, n_eval_episodes=episodes)
 print('LLP:', mean_reward_llp, std_reward_llp, env_llp.actions_output)
+
+# the running services of the graph and of each link are sequences of service ids
+running_services = env_llp.topology.graph['running_services']
+assert len(running_services) > 0 and all(isinstance(service_id, int) for service_id in running_services)
+assert running_services[0] in running_services
+for n1, n2 in env_llp.topology.edges():
+    assert all(service_id in running_services for service_id in env_llp.topology[n1][n2]['running_services'])
@@ -0,0 +1,81 @@
+import gym
+import optical_rl_gym
+from optical_rl_gym.utils import evaluate_heuristic, random_policy
+
+import pickle
+
+seed = 10
+episode_length = 300
+
+with open(f'../examples/topologies/nsfnet_chen_eon_5-paths.h5', 'rb') as f:
+    topology_eon = pickle.load(f)
+with open(f'../examples/topologies/nsfnet_chen_5-paths.h5', 'rb') as f:
+    topology = pickle.load(f)
+
+env_args = {
+    'RMSA-v0': dict(topology=topology_eon, load=100, mean_service_holding_time=25, num_spectrum_resources=64),
+    'DeepRMSA-v0': dict(topology=topology_eon, mean_service_inter_arrival_time=0.25, num_spectrum_resources=64),
+    'RWA-v0': dict(topology=topology, load=100, mean_service_holding_time=25, num_spectrum_resources=16),
+    'QoSConstrainedRA-v0': dict(topology=topology, load=50, mean_service_holding_time=25, num_spectrum_resources=16,
+                                num_service_classes=2, classes_arrival_probabilities=[.5, .5],
+                                classes_reward=[10., 1.]),
+}
+
+
+def stored_services(env):
+    return len(env.topology.graph['services']), \
+        max(len(env.topology[n1][n2]['services']) for n1, n2 in env.topology.edges())
+
+
+# every registered environment is constructed and run with each retention policy
+for env_id, kwargs in env_args.items():
+    rewards = {}
+    for retention in ['all', 'none', 5, 0, 'callable']:
+        streamed = []
+        env = gym.make(env_id, seed=seed, episode_length=episode_length, allow_rejection=True,
+                       service_retention=streamed.append if retention == 'callable' else retention, **kwargs)
+        rewards[retention], _ = evaluate_heuristic(env, random_policy, n_eval_episodes=2)
+        num_services, max_link_services = stored_services(env)
+        if retention == 'all':
+            # evaluate_heuristic only resets the counters between episodes, so the services of both are kept
+            assert num_services == 2 * episode_length and max_link_services > 5
+        elif retention == 'callable':
+            assert num_services == 0 and max_link_services == 0 and len(streamed) == 2 * episode_length
+        else:
+            bound = 0 if retention == 'none' else retention
+            assert num_services == bound and max_link_services <= bound
+        # the retention policy does not change the simulation
+        assert rewards[retention] == rewards['all']
+    print(env_id, 'reward:', rewards['all'])
+
+# the stored services stay bounded over a long run without full resets
+env = gym.make('RMSA-v0', seed=seed, episode_length=episode_length, service_retention=20, **env_args['RMSA-v0'])
+evaluate_heuristic(env, random_policy, n_eval_episodes=20)
+num_services, max_link_services = stored_services(env)
+assert num_services == 20 and max_link_services <= 20
+print('services stored after', env.services_processed, 'requests:', num_services)
+
+# with 'none' the processed services are recycled, but the service of a step is never reused by the next one
+for env_id, kwargs in env_args.items():
+    env = gym.make(env_id, seed=seed, episode_length=episode_length, allow_rejection=True, service_retention='none',
+                   **kwargs)
+    env.reset()
+    recycled = 0
+    seen = set()
+    for _ in range(episode_length):
+        service, service_id = env.service, env.service.service_id
+        recycled += id(service) in seen
+        seen.add(id(service))
+        env.step(env.action_space.sample())
+        assert env.service is not service and service.service_id == service_id
+    assert recycled > 0
+    print(env_id, 'recycled services:', recycled)
+
+# booleans are not numbers of services
+for retention in [True, False, -1, 'last']:
+    try:
+        gym.make('RMSA-v0', seed=seed, service_retention=retention, **env_args['RMSA-v0'])
+        raise RuntimeError('service_retention={!r} was accepted'.format(retention))
+    except AssertionError:
+        pass
+print('invalid retention policies rejected')
@@ -0,0 +1,77 @@
+from optical_rl_gym import topology as topology_module
+from optical_rl_gym.topology import build_topology, save_topology, load_topology
+from optical_rl_gym.envs.rmsa_env import shortest_available_path_first_fit
+from optical_rl_gym.utils import is_indexed, indexed_topology
+
+import os
+import gym
+import networkx as nx
+import copy
+import time
+import pickle
+import tempfile
+
+import sys
+sys.path.append('../examples')
+from graph_utils import read_txt_file
+
+with open(f'../examples/topologies/nsfnet_chen_eon_5-paths.h5', 'rb') as f:
+    topology = pickle.load(f)
+
+
+def paths(topology):
+    return sorted((pair, [(path.path_id, path.node_list, path.length, path.best_modulation) for path in path_list])
+                  for pair, path_list in topology.graph['ksp'].items())
+
+
+# the builder reproduces the topology shipped with the examples
+start = time.time()
+built = build_topology(read_txt_file('../examples/topologies/nsfnet_chen.txt'), 'NSFNET', k_paths=5,
+                       modulations=topology.graph['modulations'])
+print(f'built in {time.time() - start:.3f}s')
+assert paths(built) == paths(topology)
+
+# the paths are only kept in memory for the most recently used topologies
+for num_nodes in range(4, 4 + topology_module.KSP_CACHE_SIZE + 2):
+    ring = nx.cycle_graph(num_nodes)
+    nx.set_edge_attributes(ring, {edge: idx for idx, edge in enumerate(ring.edges())}, 'index')
+    nx.set_edge_attributes(ring, 100., 'length')
+    build_topology(ring, 'ring', k_paths=2)
+assert len(topology_module._ksp_cache) == topology_module.KSP_CACHE_SIZE
+
+# environments share the paths of indexed topologies, and do not modify the topology they are created from
+envs = [gym.make('RMSA-v0', topology=t, seed=10).unwrapped for t in [built, built, topology]]
+assert envs[0].k_shortest_paths is envs[1].k_shortest_paths
+assert envs[2].k_shortest_paths is not topology.graph['ksp']
+assert all(getattr(path, 'links', None) is None for path_list in topology.graph['ksp'].values() for path in path_list)
+assert set(topology.graph) == {'name', 'ksp', 'modulations', 'k_paths', 'node_indices'}
+# a pickled topology is indexed once on a copy, whose paths are then shared by the environments
+indexed = indexed_topology(topology)
+assert is_indexed(indexed) and not is_indexed(topology) and paths(indexed) == paths(topology)
+envs = [gym.make('RMSA-v0', topology=indexed, seed=10).unwrapped for _ in range(2)]
+assert envs[0].k_shortest_paths is envs[1].k_shortest_paths is indexed.graph['ksp']
+del envs
+
+# the compact file loads the same topology, and the environments produce the same results with it
+with tempfile.TemporaryDirectory() as directory:
+    save_topology(built, os.path.join(directory, 'nsfnet.topo'))
+    start = time.time()
+    loaded = load_topology(os.path.join(directory, 'nsfnet.topo'))
+    print(f'loaded in {time.time() - start:.3f}s')
+
+    rewards = []
+    for t in [topology, loaded]:
+        env = gym.make('RMSA-v0', topology=t, seed=10, load=200, mean_service_holding_time=25, episode_length=1000)
+        reward, done = 0, False
+        while not done:
+            _, r, done, _ = env.step(shortest_available_path_first_fit(env))
+            reward += r
+        rewards.append(reward)
+    print('rewards:', rewards)
+    assert rewards[0] == rewards[1]
+    assert paths(loaded) == paths(topology)
+    del t, env, loaded
+
+    # the modulation formats of copied paths are equal but not identical to those of the topology
+    save_topology(copy.deepcopy(built), os.path.join(directory, 'copy.topo'))
+    assert paths(load_topology(os.path.join(directory, 'copy.topo'), mmap=False)) == paths(topology)
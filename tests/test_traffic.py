@@ -0,0 +1,95 @@
+import gym
+from optical_rl_gym.envs.rmsa_env import shortest_path_first_fit, shortest_available_path_first_fit
+from optical_rl_gym.traffic import TrafficTrace, TrafficRecorder
+
+import os
+import time
+import pickle
+import tempfile
+import logging
+import numpy as np
+
+load = 50
+logging.getLogger('rmsaenv').setLevel(logging.INFO)
+
+seed = 20
+episode_length = 2000
+
+with open(f'../examples/topologies/nsfnet_chen_eon_5-paths.h5', 'rb') as f:
+    topology = pickle.load(f)
+
+env_args = dict(topology=topology, seed=seed, allow_rejection=True, load=load, mean_service_holding_time=25,
+                episode_length=episode_length, num_spectrum_resources=64)
+
+# the same pre-generated requests are replayed for each heuristic (the last step already draws the next request)
+trace = gym.make('RMSA-v0', **env_args).generate_traffic(episode_length + 1, seed=seed)
+
+for heuristic in [shortest_path_first_fit, shortest_available_path_first_fit]:
+    env = gym.make('RMSA-v0', traffic=trace, **env_args)
+    requests = []
+    rewards = 0
+    start = time.time()
+    done = False
+    while not done:
+        requests.append((env.service.source_id, env.service.destination_id, env.service.bit_rate))
+        _, reward, done, _ = env.step(heuristic(env))
+        rewards += reward
+    print(heuristic.__name__, rewards, f'{episode_length / (time.time() - start):.1f} steps/s')
+    assert requests == list(zip(trace.source_id.tolist(), trace.destination_id.tolist(), trace.bit_rate.tolist()))[:-1]
+
+    # a full reset replays the trace from the beginning
+    env.reset(only_counters=False)
+    assert env.service.arrival_time == trace.arrival_time[0]
+
+# requests generated in chunks as the simulation goes
+env = gym.make('RMSA-v0', traffic_chunk_size=500, **env_args)
+rewards = 0
+for _ in range(episode_length):
+    _, reward, _, _ = env.step(shortest_path_first_fit(env))
+    rewards += reward
+print('chunked', rewards)
+
+# requests drawn by an environment are recorded, saved into a file and replayed from the memory-mapped file
+env = gym.make('RMSA-v0', **env_args)
+env.traffic_recorder = TrafficRecorder()
+env.reset(only_counters=False)
+rewards = 0
+done = False
+while not done:
+    _, reward, done, _ = env.step(shortest_path_first_fit(env))
+    rewards += reward
+with tempfile.TemporaryDirectory() as directory:
+    env.traffic_recorder.save(os.path.join(directory, 'trace.bin'), metadata={'load': load})
+    trace = TrafficTrace.load(os.path.join(directory, 'trace.bin'))
+    assert trace.metadata == {'load': load} and isinstance(trace.bit_rate, np.ndarray)
+    env = gym.make('RMSA-v0', traffic=trace, **env_args)
+    replayed_rewards = 0
+    done = False
+    while not done:
+        _, reward, done, _ = env.step(shortest_path_first_fit(env))
+        replayed_rewards += reward
+    del trace, env
+print('recorded', rewards, 'replayed', replayed_rewards)
+assert rewards == replayed_rewards
+
+# requests streamed into a file in chunks of buffer_size, keeping at most buffer_size requests in memory
+with tempfile.TemporaryDirectory() as directory:
+    env = gym.make('RMSA-v0', **env_args)
+    env.traffic_recorder = TrafficRecorder()
+    env.reset(only_counters=False)
+    streaming_env = gym.make('RMSA-v0', **env_args)
+    with TrafficRecorder(os.path.join(directory, 'stream.bin'), buffer_size=100, metadata={'load': load}) as recorder:
+        streaming_env.traffic_recorder = recorder
+        streaming_env.reset(only_counters=False)
+        for _ in range(episode_length):
+            env.step(shortest_path_first_fit(env))
+            streaming_env.step(shortest_path_first_fit(streaming_env))
+            assert len(recorder.requests) < 100
+    assert sorted(os.listdir(directory)) == ['stream.bin']
+    trace = TrafficTrace.load(os.path.join(directory, 'stream.bin'))
+    recorded = env.traffic_recorder.to_trace()
+    assert len(trace) == len(recorded) == len(recorder) and trace.metadata == {'load': load}
+    assert all(np.array_equal(getattr(trace, column), getattr(recorded, column)) for column in TrafficTrace.columns
+               if column != 'service_class') and trace.service_class is None
+    del trace
+print('streamed', len(recorded))
@@ -0,0 +1,75 @@
+import gym
+from optical_rl_gym.vector_env import SharedMemoryVectorEnv
+
+import time
+import pickle
+import numpy as np
+
+seed = 10
+num_envs = 2
+episode_length = 200
+
+
+class SlowStep(gym.Wrapper):
+    def step(self, action):
+        time.sleep(10)
+        return self.env.step(action)
+
+
+if __name__ == '__main__':
+    with open(f'../examples/topologies/nsfnet_chen_eon_5-paths.h5', 'rb') as f:
+        topology = pickle.load(f)
+
+    env_args = dict(mean_service_holding_time=25, mean_service_inter_arrival_time=.25, episode_length=episode_length,
+                    num_spectrum_resources=64, allow_rejection=True)
+
+    vector_env = SharedMemoryVectorEnv('DeepRMSA-v0', num_envs, topology, env_kwargs=env_args, seed=seed)
+    envs = [gym.make('DeepRMSA-v0', topology=topology, seed=seed + i, **env_args) for i in range(num_envs)]
+
+    observations = vector_env.reset()
+    assert np.all(observations == np.stack([env.reset() for env in envs]))
+    assert np.all(vector_env.action_masks() == np.stack([env.action_masks() for env in envs]))
+
+    vector_rewards, rewards = np.zeros(num_envs), np.zeros(num_envs)
+    start = time.time()
+    for _ in range(episode_length):
+        # first valid action of each environment
+        actions = np.argmax(vector_env.action_masks(), axis=1)
+        observations, reward, dones, infos = vector_env.step(actions)
+        vector_rewards += reward
+    print('shared memory:', vector_rewards, f'{num_envs * episode_length / (time.time() - start):.1f} steps/s')
+    assert np.all(dones)
+
+    for i, env in enumerate(envs):
+        done = False
+        while not done:
+            _, reward, done, info = env.step(np.argmax(env.action_masks()))
+            rewards[i] += reward
+        env.reset()
+        # the vector environment resets the environments that finish their episodes
+        assert np.all(observations[i] == env.observation())
+        assert infos[i]['service_blocking_rate'] == info['service_blocking_rate']
+    print('sequential:   ', rewards)
+    assert np.all(vector_rewards == rewards)
+    vector_env.close()
+
+    # a worker that exits, or that does not finish in time, is reported instead of blocking the main process
+    vector_env = SharedMemoryVectorEnv('DeepRMSA-v0', num_envs, topology, env_kwargs=env_args, seed=seed)
+    vector_env.reset()
+    vector_env._processes[1].kill()
+    vector_env._processes[1].join()
+    try:
+        vector_env.step(np.zeros(num_envs, dtype=int))
+        raise AssertionError('the step did not fail')
+    except RuntimeError as e:
+        assert 'environment 1 exited unexpectedly' in str(e)
+    vector_env = SharedMemoryVectorEnv('DeepRMSA-v0', num_envs, topology, env_kwargs=env_args, seed=seed,
+                                       wrapper=SlowStep, timeout=1)
+    vector_env.reset()
+    start = time.time()
+    try:
+        vector_env.step(np.zeros(num_envs, dtype=int))
+        raise AssertionError('the step did not fail')
+    except RuntimeError as e:
+        assert 'timeout' in str(e) and time.time() - start < 10
+    print('failures reported')